@@ -19,11 +19,17 @@ long_description = ('\n'.join([
 install_requires = [
     'setuptools',
     # -*- Extra requirements: -*-
+    'BTrees',
     'persistent',
+    'transaction',
     'z3c.form',
     'zope.browserpage',
     'zope.component',
+    'zope.event',
+    'zope.i18n',
     'zope.interface',
+    'zope.lifecycleevent',
+    'zope.publisher',
     'zope.session',
     'zope.traversing',
 ]
@@ -61,11 +67,15 @@ setup(
     zip_safe=False,
     extras_require=dict(
         test=[
+            'transaction',
             'unittest2',
             'z3c.form [test]',
+            'z3c.pt',
             'zc.buildout',
+            'ZODB',
             'zope.browserpage',
             'zope.publisher',
+            'zope.site',
             'zope.testing',
             'zope.traversing',
         ],
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Timing instrumentation for the phases of a wizard request.
+
+Instrumentation is disabled unless at least one IWizardTimingSink utility
+is registered or the wizard sets a ``timing_header``. Register one of the
+sinks below, e.g. in ZCML::
+
+  <utility
+      factory="ps.zope.wizard.instrumentation.LoggingSink"
+      name="logging"
+      />
+
+Once per request, every sink receives the timings of all phases which ran
+(``update``, ``update_active_steps``, ``initialize``, ``load_steps``,
+``update_current_step``, the button handlers, ``finish``, ``apply_steps``,
+``sync`` and ``render``) and the approximate number of session bytes
+written.
+"""
+
+# python imports
+import functools
+import logging
+import pickle
+import socket
+import time
+from contextlib import contextmanager
+
+# zope imports
+from zope.component import getUtilitiesFor
+from zope.event import notify
+from zope.interface import implementer
+
+# local imports
+from ps.zope.wizard.interfaces import (
+    IWizardPhaseEvent,
+    IWizardTimingSink,
+)
+
+
+logger = logging.getLogger('ps.zope.wizard')
+
+_unset = object()
+
+
+def _timings(wizard):
+    """Return the list collecting the timings of a wizard request.
+
+    Returns None if instrumentation is disabled. The state is determined
+    once per request.
+    """
+    timings = wizard.__dict__.get('_timings', _unset)
+    if timings is _unset:
+        enabled = wizard.timing_header or \
+            any(True for item in getUtilitiesFor(IWizardTimingSink))
+        timings = wizard._timings = [] if enabled else None
+    return timings
+
+
+def timed(phase):
+    """Decorate a wizard or step method to record its duration."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kw):
+            timings = _timings(getattr(self, 'wizard', None) or self)
+            if timings is None:
+                return func(self, *args, **kw)
+            start = time.time()
+            try:
+                return func(self, *args, **kw)
+            finally:
+                timings.append((phase, time.time() - start))
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def measure(wizard, phase):
+    """Record the duration of a block of code as a wizard phase."""
+    timings = _timings(wizard)
+    if timings is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings.append((phase, time.time() - start))
+
+
+def record_session_bytes(wizard, values):
+    """Record the approximate size of session values being written."""
+    if _timings(wizard) is None:
+        return
+    size = 0
+    for value in values:
+        try:
+            size += len(pickle.dumps(value, 2))
+        except Exception:
+            continue
+    wizard._session_bytes = getattr(wizard, '_session_bytes', 0) + size
+
+
+def report(wizard):
+    """Send the timings of a wizard request to the sinks.
+
+    Also sets the timing header on the response, if configured. Timings
+    are reported only once.
+    """
+    timings = _timings(wizard)
+    if not timings:
+        return
+    session_bytes = getattr(wizard, '_session_bytes', 0)
+    for name, sink in getUtilitiesFor(IWizardTimingSink):
+        try:
+            sink.record(wizard, timings, session_bytes)
+        except Exception:
+            logger.exception('Failed to record wizard timings.')
+    if wizard.timing_header:
+        wizard.request.response.setHeader(
+            wizard.timing_header, server_timing(timings),
+        )
+    wizard._timings = []
+    wizard._session_bytes = 0
+
+
+def server_timing(timings):
+    """Format timings as a Server-Timing header value."""
+    return ', '.join(
+        '{0};dur={1:.2f}'.format(phase, duration * 1000)
+        for phase, duration in timings
+    )
+
+
+@implementer(IWizardPhaseEvent)
+class WizardPhaseEvent(object):
+    """A phase of a wizard request has been timed."""
+
+    def __init__(self, wizard, phase, duration):
+        self.wizard = wizard
+        self.phase = phase
+        self.duration = duration
+
+
+@implementer(IWizardTimingSink)
+class EventSink(object):
+    """Notify a WizardPhaseEvent for every timed phase."""
+
+    def record(self, wizard, timings, session_bytes):
+        for phase, duration in timings:
+            notify(WizardPhaseEvent(wizard, phase, duration))
+
+
+@implementer(IWizardTimingSink)
+class LoggingSink(object):
+    """Log the timings of each request."""
+
+    def __init__(self, logger=logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def record(self, wizard, timings, session_bytes):
+        self.logger.log(self.level, '{0}: {1}; session bytes: {2}'.format(
+            wizard.__name__, server_timing(timings), session_bytes,
+        ))
+
+
+@implementer(IWizardTimingSink)
+class StatsdSink(object):
+    """Send the timings to a statsd compatible daemon via UDP."""
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='ps.zope.wizard'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = None
+
+    def record(self, wizard, timings, session_bytes):
+        lines = [
+            '{0}.{1}:{2:.3f}|ms'.format(self.prefix, phase, duration * 1000)
+            for phase, duration in timings
+        ]
+        lines.append('{0}.session_bytes:{1}|c'.format(
+            self.prefix, session_bytes,
+        ))
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._socket.sendto(
+                '\n'.join(lines).encode('utf-8'), self.address,
+            )
+        except socket.error:
+            logger.debug('Failed to send wizard timings to statsd.')
@@ -3,14 +3,18 @@
 
 # zope imports
 from z3c.form.interfaces import IForm
-from zope.interface import Attribute
+from zope.interface import (
+    Attribute,
+    Interface,
+)
 
 
 class IStep(IForm):
     """A single step of a z3c.form based wizard.
 
     By default, the content accessed by this form will be a PersistentDict
-    within the wizard session, with a key equal to the step's prefix.
+    within the wizard session, with a key equal to the step's prefix. It is
+    created on the first write to the content.
     """
 
     label = Attribute("""Title displayed at the wizard step.""")
@@ -28,6 +32,37 @@ class IStep(IForm):
         respective buttons regardless of the value of this property.
         """)
 
+    concurrent_load = Attribute("""
+        Set to True if the load method is I/O bound and thread-safe. Such
+        steps may be loaded concurrently if the wizard has load_workers.
+        While loading concurrently, getContent returns a private buffer
+        which is merged into the session afterwards.
+
+        The load method runs in another thread and gets the context loaded
+        from a separate connection to the database. It must only use that
+        context, not self.context or other persistent objects of the
+        request, and must not change anything: the separate connection is
+        aborted afterwards.
+        """)
+
+    condition = Attribute("""
+        A function condition(wizard) returning whether the step is part of
+        the path of active steps. None (the default) always includes it.
+        """)
+
+    next_step = Attribute("""
+        The prefix of the step following this one, or a function
+        next_step(wizard) returning it. None (the default) continues with
+        the next step in the wizard's steps.
+        """)
+
+    depends_on = Attribute("""
+        The session data condition and next_step depend on, as a sequence
+        of step prefixes or (prefix, field name) tuples. The path of active
+        steps is memoized by these values. If a step with a condition or
+        next_step doesn't declare it, the path is computed on every request.
+        """)
+
     enabled = Attribute("""
         Indicates whether the user should be allowed to move on to the
         next step or not. Defaults to True. If false, the Continue button
@@ -44,7 +79,13 @@ class IStep(IForm):
         """Load the data for this step based on a context."""
 
     def apply(context):  # noqa
-        """Update a context based on the session data for this step."""
+        """Update a context based on the session data for this step.
+
+        Instead of notifying events or reindexing the context, steps should
+        return their changes as a mapping of interfaces to lists of changed
+        attribute names. The wizard notifies a single ObjectModifiedEvent
+        for the changes of all steps.
+        """
 
 
 class IWizard(IForm):
@@ -58,7 +99,8 @@ class IWizard(IForm):
     active_steps = Attribute("""
         A sequence of active wizard step instances.
 
-        Available after the wizard's update method has been called.
+        Steps are instantiated lazily, the first time they are accessed by
+        index. Available after the wizard's update method has been called.
         """)
 
     current_step = Attribute("""
@@ -77,6 +119,13 @@ class IWizard(IForm):
         path to the wizard.
         """)
 
+    session_key_strategy = Attribute("""
+        How the context is identified within the session key. One of
+        'path' (the default), 'intid' or 'uid'. The intid and UID
+        strategies avoid computing the path of deeply nested contexts and
+        fall back to the path if the context has no intid or UID.
+        """)
+
     session = Attribute("""
         The session where data for this wizard is persisted.
 
@@ -96,22 +145,141 @@ class IWizard(IForm):
         True if the 'finished' attribute of each wizard step is True.
         """)
 
+    finished_steps = Attribute("""
+        A bitmap of the finished steps, by position in steps.
+
+        Kept in the session and updated when a step is marked finished.
+        """)
+
     finished = Attribute("""
         True if the wizard has been completed and the final actions have run.
         """)
 
     absolute_url = Attribute("""The URL of the wizard.""")
 
+    navigation = Attribute("""
+        A sequence of (index, label, url, state) tuples, one for each
+        active step. The state is 'current', 'finished' or 'pending'.
+        """)
+
     validate_back = Attribute("""
         Set to True if you want the Wizard to validate the input if a user
         uses the Back button on a Step. Set to False if you don't and abandon
         all user input (data).
         """)
 
+    redirect_navigation = Attribute("""
+        Set to True to redirect to the new step after a successful Continue
+        or Back (Post/Redirect/Get), instead of updating and rendering the
+        new step in the same request.
+        """)
+
+    fragment_header = Attribute("""
+        The name of a request header selecting the fragment mode, e.g.
+        'X-Wizard-Fragment'. In fragment mode, the wizard renders only the
+        current step and its state as JSON (see render_fragment).
+        """)
+
+    fragment_parameter = Attribute("""
+        The name of a request parameter selecting the fragment mode, e.g.
+        'fragment'.
+        """)
+
+    etag_caching = Attribute("""
+        Set to True to let browsers cache the pages of the wizard and
+        revalidate them with an ETag. The ETag combines a revision of the
+        wizard data, incremented by sync, with the current step. GET
+        requests with a matching If-None-Match header are answered with
+        304 before any step is updated.
+        """)
+
     confirmation_page_name = Attribute("""
         The confirmation page name shown after completed.
         """)
 
+    load_workers = Attribute("""
+        The maximum number of threads used to load steps declaring
+        concurrent_load. 0 (the default) loads all steps sequentially.
+        """)
+
+    lazy_load = Attribute("""
+        Set to True to load each step the first time it becomes current or
+        its data is needed, instead of loading all steps when the wizard
+        session is created.
+        """)
+
+    loaded_steps = Attribute("""
+        A bitmap of the steps which have been loaded, by position in steps.
+
+        Kept in the session, so steps are loaded only once per session.
+        """)
+
+    timing_header = Attribute("""
+        The name of a response header reporting the duration of the phases
+        of the request, e.g. 'Server-Timing'. None disables the header.
+        """)
+
+    job_runner = Attribute("""
+        The name of an IWizardJobRunner utility. If set, the default finish
+        implementation queues a job applying the steps and returns at once,
+        instead of applying the steps in the request. None (the default)
+        applies the steps in the request.
+        """)
+
+    data_conflicts = Attribute("""
+        The policy of get_all_data for keys used by several steps: 'last'
+        (the default), 'first' or 'error'.
+        """)
+
+    session_ttl = Attribute("""
+        The number of seconds after which the data of an unused wizard
+        expires. None (the default) keeps the data for the lifetime of
+        the session.
+        """)
+
+    max_instances = Attribute("""
+        The maximum number of wizards with data in a user's session. The
+        least recently used wizards are removed when a new one is started.
+        None (the default) doesn't limit the number.
+        """)
+
+    storage_name = Attribute("""
+        The name of the IWizardStorage adapter used to store the wizard data.
+
+        Defaults to the unnamed adapter, which stores the data in the
+        ZODB session.
+        """)
+
+    def step_path():
+        """Return the positions in steps of the active steps.
+
+        Steps whose condition fails are skipped, next_step continues the
+        path at another step.
+        """
+
+    def navigate(index):  # noqa
+        """Move on to the step at index after a successful submit."""
+
+    def validate(prefix=None, names=None):  # noqa
+        """Validate the input for a step without changing the wizard data.
+
+        Only the widgets of the step with the given prefix (or the current
+        step) are updated, optionally only those of the fields with the
+        given names, or returned by names(step). Returns the step and the
+        error view snippets.
+        """
+
+    def etag():
+        """Return the entity tag of the page, or None for a new wizard."""
+
+    def render_fragment():
+        """Render the current step and the state of the wizard as JSON.
+
+        The JSON object has the keys 'html' (the rendered step), 'index',
+        'count', 'prefix', 'label', 'finished' (a list of the finished
+        state of the active steps) and 'next_url'.
+        """
+
     def initialize():
         """Called the first time a wizard is viewed in a new wizard session.
 
@@ -121,15 +289,35 @@ class IWizard(IForm):
         instead of dict), or else changes to subitems may be changed without
         those changes getting persisted.
 
-        The default implementation calls the 'load_steps' method.
+        The default implementation calls the 'load_steps' method, unless
+        lazy_load is set.
         """
 
     def load_steps(context):  # noqa
         """Load the wizard session data from a context.
 
-        The default implementation calls the 'load' method of each wizard step.
+        The default implementation calls the 'load' method of each wizard step
+        which has not been loaded yet. With lazy_load, single steps are
+        loaded directly when they are needed, without calling this method.
         """
 
+    def step_loaded(index):  # noqa
+        """Check if the step at index has been loaded."""
+
+    def get_all_data(conflicts=None):  # noqa
+        """Return a read-only mapping of the data of all steps.
+
+        Internal keys like '_finished' are hidden. conflicts overrides the
+        data_conflicts policy.
+
+        Steps which haven't been loaded yet are loaded and the session is
+        synced, so the first call may write to the session and change the
+        ETag of the wizard. Call it before rendering, not from a template.
+        """
+
+    def set_step_finished(index, finished):  # noqa
+        """Record the finished state of the step at index."""
+
     def finish():
         """Called when a wizard is successfully completed
 
@@ -138,18 +326,176 @@ class IWizard(IForm):
         Use this method to carry out some actions based on the values that have
         been filled out during completion of the wizard.
 
-        The default implementation calls the 'apply_steps' method.
+        The default implementation calls the 'apply_steps' method, or
+        queues a job if job_runner is set.
         """
 
+    def submit_job():
+        """Queue a job applying the steps and return it.
+
+        The job holds a snapshot of the wizard data and is executed by the
+        IWizardJobRunner utility named by job_runner.
+        """
+
+    def job_status_url(job):  # noqa
+        """Return the URL reporting the status of a job."""
+
     def apply_steps(context):  # noqa
         """Update a context based on the wizard session data.
 
         The default implementation calls the 'apply' method of each wizard
-        step.
+        step and notifies a single ObjectModifiedEvent with the combined
+        changes, which are returned. Each step is applied within a
+        savepoint. If any step fails, the changes of all steps are rolled
+        back and an ApplyError is raised.
         """
 
-    def sync():
+    def sync(prefix=None):  # noqa
         """Mark the session as having changed.
 
-        Do this to ensure that changes get persisted.
+        Do this to ensure that changes get persisted. If given, prefix is
+        the prefix of a step which has been changed in place. Only changes
+        recorded in the session are persisted, so nothing is written if no
+        data has changed.
+        """
+
+
+class IWizardStorage(Interface):
+    """A storage backend for the data of wizards.
+
+    Storages are adapters of the wizard. The data of a wizard is a mapping
+    of step prefixes to step contents, stored under the wizard's session
+    key.
+    """
+
+    def get(key, default=None):  # noqa
+        """Return the wizard data stored under key, or default."""
+
+    def create(key):  # noqa
+        """Create, store and return an empty data mapping for key."""
+
+    def remove(key):  # noqa
+        """Remove the wizard data stored under key, if any."""
+
+    def touch(key, ttl=None):  # noqa
+        """Record that the wizard data stored under key has been used.
+
+        If ttl (in seconds) is given, the data expires once it hasn't been
+        used for that long.
+        """
+
+    def expired(key):  # noqa
+        """Check if the wizard data stored under key has expired."""
+
+    def sweep(max_entries=None):  # noqa
+        """Remove the expired wizard data of the current user.
+
+        If max_entries is given, the least recently used wizard data
+        beyond that number is removed as well. Only wizards which have
+        been touched are considered. Returns the removed keys.
+        """
+
+    def sync(key, prefix=None):  # noqa
+        """Persist changes of the wizard data stored under key.
+
+        If given, prefix is the key within the wizard data (e.g. the prefix
+        of a step) which has been changed. Otherwise the complete wizard
+        data is considered changed.
+        """
+
+
+class IWizardJob(Interface):
+    """A queued execution of the final actions of a wizard."""
+
+    id = Attribute("""The unique id of the job.""")
+
+    status = Attribute("""
+        One of 'pending', 'running', 'done' or 'failed'.
+        """)
+
+    context = Attribute("""The context the wizard has been used on.""")
+
+    view_name = Attribute("""The name of the wizard view.""")
+
+    data = Attribute("""
+        A snapshot of the wizard session data. None once the job has run.
+        """)
+
+    next_url = Attribute("""The URL to show once the job is done.""")
+
+    error = Attribute("""A description of the error if the job failed.""")
+
+    def run(wizard=None, request=None):  # noqa
+        """Apply the steps of the wizard using the data snapshot.
+
+        If no wizard is given, the wizard view is looked up on the context
+        with the request.
+        """
+
+    def fail(error):  # noqa
+        """Mark the job as failed with the given error description."""
+
+
+class IWizardJobQueue(Interface):
+    """A durable container for wizard jobs.
+
+    Usually registered as a persistent local utility.
+    """
+
+    def add(job):  # noqa
+        """Add a new job to the queue."""
+
+    def get(job_id, default=None):  # noqa
+        """Return the job with the given id, or default."""
+
+    def pending():
+        """Return the pending jobs, oldest first."""
+
+    def claim(job=None):  # noqa
+        """Remove a job from the pending jobs and return it.
+
+        Claims the oldest pending job if none is given. Returns None if
+        there is no such pending job.
+        """
+
+    def purge(older_than):  # noqa
+        """Remove the jobs which have run before the timestamp older_than.
+
+        Returns the number of jobs removed.
+        """
+
+
+class IWizardJobRunner(Interface):
+    """Executes queued wizard jobs.
+
+    Register runners as named utilities. Wizards select one by name with
+    their job_runner attribute.
+    """
+
+    def schedule(job, wizard):  # noqa
+        """Schedule the execution of a job added by wizard."""
+
+
+class IWizardTimingSink(Interface):
+    """Receives the timings of wizard requests.
+
+    Register sinks as (named) utilities to enable the instrumentation.
+    """
+
+    def record(wizard, timings, session_bytes):  # noqa
+        """Record the timings of a wizard request.
+
+        timings is a list of (phase, duration in seconds) tuples, in the
+        order the phases ended. session_bytes is the approximate size of
+        the session data written.
         """
+
+
+class IWizardPhaseEvent(Interface):
+    """A phase of a wizard request has been timed."""
+
+    wizard = Attribute("""The wizard.""")
+
+    phase = Attribute("""The name of the phase, e.g. 'update'.""")
+
+    duration = Attribute("""The duration of the phase in seconds.""")
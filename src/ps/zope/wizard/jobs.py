@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""Queued execution of the final actions of wizards.
+
+Applying the steps of a wizard (e.g. creating content and reindexing it)
+can be slow and conflict-prone. Wizards setting ``job_runner`` store a
+snapshot of their data in a job instead and let a runner apply it outside
+of the request:
+
+``inline``
+  Runs the job right away, in the request. Mostly useful for tests.
+
+``thread``
+  Runs the job in a thread of the same process, once the request has been
+  committed.
+
+``queue``
+  Leaves the job in the queue, for ``process_jobs`` running in a separate
+  process, e.g. a ``zopectl run`` script.
+
+The jobs are stored in an IWizardJobQueue utility, usually a persistent
+``WizardJobQueue`` registered as a local utility of the site. Clients poll
+the ``@@wizard-job`` view for the status of a job. The data snapshot of a
+job is dropped once it has run, and ``process_jobs`` purges jobs which
+have run more than ``JOB_RETENTION`` seconds ago.
+"""
+
+# python imports
+import io
+import json
+import logging
+import threading
+import time
+import traceback
+import uuid
+
+# zope imports
+import transaction
+from BTrees.OOBTree import (
+    OOBTree,
+    OOTreeSet,
+)
+from persistent import Persistent
+from persistent.mapping import PersistentMapping
+from zope.component import (
+    getMultiAdapter,
+    getUtility,
+    queryUtility,
+)
+from zope.component.hooks import (
+    getSite,
+    setSite,
+)
+from zope.interface import implementer
+from zope.publisher.browser import (
+    BrowserRequest,
+    BrowserView,
+)
+from zope.publisher.skinnable import setDefaultSkin
+
+# local imports
+from ps.zope.wizard.interfaces import (
+    IWizardJob,
+    IWizardJobQueue,
+    IWizardJobRunner,
+)
+from ps.zope.wizard.storage import (
+    TRANSIENT_ERRORS,
+    WizardSession,
+)
+
+
+logger = logging.getLogger('ps.zope.wizard')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# The number of seconds the status of a job is kept after it has run.
+JOB_RETENTION = 24 * 3600
+
+
+def job_request(environ=None):
+    """Return a browser request for running jobs outside of a request."""
+    request = BrowserRequest(io.BytesIO(b''), dict(environ or {}))
+    setDefaultSkin(request)
+    return request
+
+
+def snapshot(session):
+    """Return a copy of the wizard session data with plain step contents."""
+    return dict(
+        (key, dict(value) if hasattr(value, 'keys') else value)
+        for key, value in session.items()
+    )
+
+
+@implementer(IWizardJob)
+class WizardJob(Persistent):
+    """A queued execution of the final actions of a wizard."""
+
+    status = PENDING
+    error = None
+    started = None
+    finished = None
+
+    def __init__(self, context, view_name, data, next_url=None):
+        self.id = uuid.uuid4().hex
+        self.created = time.time()
+        self.context = context
+        self.view_name = view_name
+        # The snapshot is a record on its own, so polling the status of a
+        # job doesn't load it.
+        self.data = PersistentMapping(data)
+        self.next_url = next_url
+
+    def run(self, wizard=None, request=None):
+        """Apply the steps of the wizard using the data snapshot.
+
+        Without a wizard, the wizard view is looked up with the request.
+        Returns True if the job is done. Changes made by a failing job are
+        rolled back and the job is marked as failed, also if the wizard
+        can't be found. Conflict errors are raised unchanged, so the
+        transaction can be retried. The data snapshot is dropped once the
+        job has run.
+        """
+        if wizard is None and request is None:
+            raise ValueError('A request is needed to look up the wizard.')
+        self.status = RUNNING
+        self.started = time.time()
+        savepoint = transaction.savepoint(optimistic=True)
+        try:
+            if wizard is None:
+                wizard = getMultiAdapter(
+                    (self.context, request), name=self.view_name,
+                )
+            wizard.session = WizardSession(dict(self.data))
+            wizard.update_active_steps()
+            wizard.apply_steps(self.context)
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception:
+            savepoint.rollback()
+            logger.exception('Wizard job {0} failed.'.format(self.id))
+            self.fail(traceback.format_exc())
+            return False
+        self.status = DONE
+        self.finished = time.time()
+        self.data = None
+        return True
+
+    def fail(self, error):
+        """Mark the job as failed and drop its data snapshot."""
+        self.status = FAILED
+        self.error = error
+        self.finished = time.time()
+        self.data = None
+
+
+@implementer(IWizardJobQueue)
+class WizardJobQueue(Persistent):
+    """Store wizard jobs in BTrees."""
+
+    def __init__(self):
+        self.jobs = OOBTree()
+        self.queue = OOTreeSet()
+
+    def add(self, job):
+        self.jobs[job.id] = job
+        self.queue.insert((job.created, job.id))
+
+    def get(self, job_id, default=None):
+        return self.jobs.get(job_id, default)
+
+    def pending(self):
+        return [self.jobs[job_id] for created, job_id in self.queue]
+
+    def claim(self, job=None):
+        """Remove a job from the pending jobs and return it.
+
+        Claims the oldest pending job if none is given. Returns None if
+        there is no such pending job, e.g. if it has been claimed already.
+        """
+        if job is None:
+            if not self.queue:
+                return None
+            key = self.queue.minKey()
+        else:
+            key = (job.created, job.id)
+            if key not in self.queue:
+                return None
+        self.queue.remove(key)
+        return self.jobs[key[1]]
+
+    def purge(self, older_than):
+        """Remove the jobs which have run before older_than.
+
+        older_than is a timestamp. Returns the number of jobs removed.
+        """
+        purged = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished is not None and job.finished < older_than
+        ]
+        for job_id in purged:
+            del self.jobs[job_id]
+        return len(purged)
+
+
+@implementer(IWizardJobRunner)
+class InlineRunner(object):
+    """Run jobs right away, in the request submitting them."""
+
+    def schedule(self, job, wizard):
+        if getUtility(IWizardJobQueue).claim(job) is not None:
+            job.run(wizard)
+
+
+@implementer(IWizardJobRunner)
+class ThreadRunner(object):
+    """Run jobs in a thread, once the request has been committed.
+
+    Persistent jobs are run and committed in a new connection of their
+    database.
+    """
+
+    def schedule(self, job, wizard):
+        transaction.get().addAfterCommitHook(
+            self._start, args=(job, getSite()),
+        )
+
+    def _start(self, status, job, site):
+        if not status:
+            return
+        jar = getattr(job, '_p_jar', None)
+        args = (job, site, None)
+        if jar is not None:
+            args = (job._p_oid, getattr(site, '_p_oid', None), jar.db())
+        thread = threading.Thread(target=self._run, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, job, site, db):
+        connection = None
+        if db is not None:
+            connection = db.open()
+            if site is not None:
+                site = connection.get(site)
+            job = connection.get(job)
+        setSite(site)
+        try:
+            if getUtility(IWizardJobQueue).claim(job) is not None:
+                job.run(request=job_request())
+            if connection is not None:
+                transaction.commit()
+        except Exception:
+            transaction.abort()
+            logger.exception('Failed to run wizard job.')
+        finally:
+            setSite(None)
+            if connection is not None:
+                connection.close()
+
+
+@implementer(IWizardJobRunner)
+class QueueRunner(object):
+    """Leave jobs in the queue, for ``process_jobs``."""
+
+    def schedule(self, job, wizard):
+        pass
+
+
+def process_jobs(queue=None, request=None, limit=None,
+                 retention=JOB_RETENTION):
+    """Run the pending jobs, each one in its own transaction.
+
+    Meant to be called by a separate process with the site set up, e.g.
+    periodically from a ``zopectl run`` script. The wizards are looked up
+    with the given request, or a new browser request. Processing stops at
+    the first conflict, leaving the job pending for the next call. Other
+    errors, e.g. while committing a job, mark the job as failed. Jobs
+    which have run more than retention seconds ago are purged. Returns the
+    number of jobs processed.
+    """
+    if queue is None:
+        queue = getUtility(IWizardJobQueue)
+    if request is None:
+        request = job_request()
+    count = 0
+    while limit is None or count < limit:
+        job = queue.claim()
+        if job is None:
+            break
+        try:
+            job.run(request=request)
+            transaction.commit()
+        except TRANSIENT_ERRORS:
+            transaction.abort()
+            logger.warning('Conflict running wizard jobs, retrying later.')
+            break
+        except Exception:
+            transaction.abort()
+            logger.exception('Wizard job {0} failed.'.format(job.id))
+            # The job is pending again after the abort.
+            queue.claim(job)
+            job.fail(traceback.format_exc())
+            transaction.commit()
+        count += 1
+    if retention is not None:
+        queue.purge(time.time() - retention)
+        transaction.commit()
+    return count
+
+
+class JobStatus(BrowserView):
+    """Report the status of the wizard job given by the ``id`` parameter.
+
+    Only the job record is loaded, not its data snapshot.
+    """
+
+    def __call__(self):
+        response = self.request.response
+        response.setHeader('Content-Type', 'application/json')
+        response.setHeader('Cache-Control', 'no-cache')
+        queue = queryUtility(IWizardJobQueue)
+        job = None
+        if queue is not None:
+            job = queue.get(self.request.form.get('id', ''), None)
+        if job is None:
+            response.setStatus(404)
+            return json.dumps({'status': None})
+        result = {'id': job.id, 'status': job.status}
+        if job.status == DONE:
+            result['next_url'] = job.next_url
+        return json.dumps(result)
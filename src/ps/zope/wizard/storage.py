@@ -0,0 +1,837 @@
+# -*- coding: utf-8 -*-
+"""Storage backends for the wizard session data."""
+
+# python imports
+import collections
+import pickle
+import threading
+import time
+
+# zope imports
+from persistent import Persistent
+from persistent.dict import PersistentDict
+from persistent.mapping import PersistentMapping
+from transaction.interfaces import TransientError
+from zope.component import (
+    adapter,
+    getUtility,
+    queryUtility,
+)
+from zope.interface import implementer
+from zope.interface.common.mapping import (
+    IEnumerableMapping,
+    IMapping,
+)
+from zope.session.interfaces import (
+    IClientId,
+    ISession,
+    ISessionDataContainer,
+)
+
+try:
+    from ZODB.POSException import ConflictError
+except ImportError:
+    ConflictError = None
+
+# local imports
+from ps.zope.wizard.interfaces import (
+    IWizard,
+    IWizardStorage,
+)
+
+
+WIZARD_SESSION_KEY = 'ps.zope.wizard'
+FINISHED_STEPS_KEY = '_finished_steps'
+LOADED_STEPS_KEY = '_loaded_steps'
+# The prefixes of the steps the bitmaps above have been built for.
+STEP_LAYOUT_KEY = '_step_layout'
+REVISION_KEY = '_revision'
+# The key of the WizardIndex within the wizards' session package. A tuple
+# like the session keys of wizards, so the keys of the package's BTree stay
+# comparable.
+INDEX_KEY = ('ps.zope.wizard.index', )
+# Wizards are touched at most once per interval (in seconds), so reading a
+# wizard doesn't write to the session on every request.
+TOUCH_INTERVAL = 60
+
+# Errors which must reach the publisher, so it retries the request.
+TRANSIENT_ERRORS = (TransientError, )
+if ConflictError is not None:
+    TRANSIENT_ERRORS += (ConflictError, )
+
+_marker = object()
+# Returned by StepContent for reads before the first write. Never changed.
+_EMPTY = {}
+_CONTAINERS = (Persistent, dict, list, set)
+# The format of serialized step contents: a protocol 2 pickle of a dict.
+BLOB_VERSION = b'\x01'
+
+
+class WizardSession(object):
+    """Track changes to the data of a wizard.
+
+    Wraps the data mapping returned by a storage. Adding, replacing or
+    removing keys marks them as dirty. In-place changes to step contents
+    must be recorded with ``mark_dirty``.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.dirty = set()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        old_value = self.data.get(key, _marker)
+        if old_value is value:
+            return
+        # Equal containers are still stored, as the caller may go on
+        # changing the new one in place.
+        if old_value == value and not isinstance(value, _CONTAINERS):
+            return
+        self.data[key] = value
+        self.dirty.add(key)
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.dirty.add(key)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def values(self):
+        return self.data.values()
+
+    def items(self):
+        return self.data.items()
+
+    def setdefault(self, key, default=None):
+        if key not in self.data:
+            self[key] = default
+        return self.data[key]
+
+    def mark_dirty(self, key):
+        """Record an in-place change of the item stored under key."""
+        self.dirty.add(key)
+
+
+class WizardIndex(Persistent):
+    """The last-touched timestamps and TTLs of the wizards in a session.
+
+    Kept separately from the wizard data, so expired wizards can be found
+    without loading any wizard data.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def touch(self, key, ttl=None, now=None):
+        """Record that the wizard stored under key has been used."""
+        if now is None:
+            now = time.time()
+        touched, old_ttl = self.entries.get(key, (None, None))
+        interval = TOUCH_INTERVAL
+        if ttl:
+            interval = min(interval, ttl / 10.0)
+        if touched is not None and old_ttl == ttl and \
+                now - touched < interval:
+            return
+        self.entries[key] = (now, ttl)
+        self._p_changed = True
+
+    def discard(self, key):
+        if key in self.entries:
+            del self.entries[key]
+            self._p_changed = True
+
+    def expired(self, key, now=None):
+        """Check if the TTL of the wizard stored under key has passed."""
+        touched, ttl = self.entries.get(key, (None, None))
+        if touched is None or ttl is None:
+            return False
+        return touched + ttl < (time.time() if now is None else now)
+
+    def stale(self, now=None, max_entries=None):
+        """Return the keys of the expired wizards.
+
+        If max_entries is given, the least recently touched wizards beyond
+        that number are returned as well.
+        """
+        stale = [key for key in self.entries if self.expired(key, now)]
+        if max_entries is not None:
+            live = sorted(
+                (touched, key)
+                for key, (touched, ttl) in self.entries.items()
+                if key not in stale
+            )
+            stale.extend(
+                key for touched, key in live[:max(len(live) - max_entries, 0)]
+            )
+        return stale
+
+    def _p_resolveConflict(self, old_state, committed_state, new_state):
+        state = dict(new_state)
+        state['entries'] = _resolve(
+            old_state.get('entries', {}),
+            committed_state.get('entries', {}),
+            new_state.get('entries', {}),
+            lambda key, committed, new: max(committed, new),
+        )
+        return state
+
+
+def _sweep(data, index, now=None, max_entries=None):
+    """Remove the stale wizards from the data of a session package."""
+    if index is None:
+        return []
+    stale = index.stale(now, max_entries)
+    for key in stale:
+        if data is not None and key in data:
+            del data[key]
+        index.discard(key)
+    return stale
+
+
+def sweep_sessions(container=None, now=None):
+    """Remove the expired wizards from all sessions of a container.
+
+    Uses the session data container of the wizards by default. Only the
+    session packages of the wizards are loaded, which hold the indexes.
+    Returns the number of wizards removed.
+    """
+    if container is None:
+        container = queryUtility(ISessionDataContainer, WIZARD_SESSION_KEY)
+    if container is None:
+        container = getUtility(ISessionDataContainer)
+    removed = 0
+    for session_data in container.data.values():
+        data = session_data.get(WIZARD_SESSION_KEY, None)
+        if data is None:
+            continue
+        removed += len(_sweep(data, data.get(INDEX_KEY, None), now))
+    return removed
+
+
+@implementer(IWizardStorage)
+@adapter(IWizard)
+class SessionStorage(object):
+    """Store the wizard data as a dictionary in the ZODB session.
+
+    Every change re-stores the complete data of the wizard in the session.
+    """
+
+    _session = None
+    _index = None
+
+    def __init__(self, wizard):
+        self.wizard = wizard
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = ISession(self.wizard.request)[WIZARD_SESSION_KEY]
+        return self._session
+
+    def get(self, key, default=None):
+        return self.session.get(key, default)
+
+    def create(self, key):
+        data = self.session[key] = {}
+        return data
+
+    def remove(self, key):
+        try:
+            del self.session[key]
+        except KeyError:
+            pass
+        index = self.index
+        if index is not None:
+            index.discard(key)
+
+    @property
+    def index(self):
+        """The WizardIndex of the session, or None if not created yet."""
+        if self._index is None:
+            self._index = self.session.get(INDEX_KEY, None)
+        return self._index
+
+    def touch(self, key, ttl=None):
+        index = self.index
+        if index is None:
+            index = self._index = self.session[INDEX_KEY] = WizardIndex()
+        index.touch(key, ttl)
+
+    def expired(self, key):
+        index = self.index
+        return index is not None and index.expired(key)
+
+    def sweep(self, max_entries=None):
+        return _sweep(self.session, self.index, max_entries=max_entries)
+
+    def sync(self, key, prefix=None):
+        session = self.session
+        data = session.get(key, None)
+        if data is not None:
+            session[key] = data
+        session._p_changed = True
+
+
+@implementer(IWizardStorage)
+@adapter(IWizard)
+class PersistentStorage(SessionStorage):
+    """Store the wizard data as a persistent mapping in the ZODB session.
+
+    The data of each step is a persistent object on its own, so a change
+    to one step only writes that step. The session itself is only written
+    when the wizard data is created or removed.
+    """
+
+    def create(self, key):
+        data = self.session[key] = PersistentMapping()
+        return data
+
+    def sync(self, key, prefix=None):
+        data = self.get(key)
+        if data is None:
+            return
+        content = data.get(prefix, None) if prefix is not None else None
+        if isinstance(content, Persistent):
+            content._p_changed = True
+        else:
+            data._p_changed = True
+
+
+@implementer(IMapping)
+class StepContent(object):
+    """A copy-on-write view of the content of a step.
+
+    Reading from a step which has no content yet doesn't create anything.
+    The first write stores a new container (a PersistentDict by default)
+    in the wizard session.
+    """
+
+    def __init__(self, session, key, factory=PersistentDict):
+        self.session = session
+        self.key = key
+        self.factory = factory
+
+    def _data(self):
+        data = self.session.get(self.key, None)
+        return _EMPTY if data is None else data
+
+    def _writable(self):
+        data = self.session.get(self.key, None)
+        if data is None:
+            self.session[self.key] = self.factory()
+            data = self.session[self.key]
+        return data
+
+    def __len__(self):
+        return len(self._data())
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __contains__(self, key):
+        return key in self._data()
+
+    def __getitem__(self, key):
+        return self._data()[key]
+
+    def get(self, key, default=None):
+        return self._data().get(key, default)
+
+    def keys(self):
+        return self._data().keys()
+
+    def values(self):
+        return self._data().values()
+
+    def items(self):
+        return self._data().items()
+
+    def __setitem__(self, key, value):
+        self._writable()[key] = value
+
+    def __delitem__(self, key):
+        del self._data()[key]
+
+    def setdefault(self, key, default=None):
+        data = self._data()
+        if key in data:
+            return data[key]
+        return self._writable().setdefault(key, default)
+
+    def update(self, *args, **kw):
+        self._writable().update(*args, **kw)
+
+
+@implementer(IEnumerableMapping)
+class MergedData(object):
+    """A read-only view of the merged contents of several steps.
+
+    Nothing is copied: keys are looked up in the step contents on access.
+    Internal keys (starting with an underscore, e.g. ``_finished``) are
+    hidden. ``conflicts`` decides which step wins if several steps have
+    the same key: ``last`` (like ``dict.update``), ``first`` or ``error``,
+    which raises a ValueError listing the duplicate keys.
+    """
+
+    def __init__(self, contents, conflicts='last'):
+        contents = [content for content in contents if content]
+        if conflicts == 'last':
+            contents.reverse()
+        elif conflicts == 'error':
+            seen = set()
+            duplicates = set()
+            for content in contents:
+                for key in content:
+                    if _internal(key):
+                        continue
+                    if key in seen:
+                        duplicates.add(key)
+                    seen.add(key)
+            if duplicates:
+                raise ValueError('Duplicate keys in wizard steps: {0}'.format(
+                    ', '.join(sorted(duplicates)),
+                ))
+        elif conflicts != 'first':
+            raise ValueError('Unknown conflict policy: {0}'.format(conflicts))
+        self.contents = contents
+
+    def __getitem__(self, key):
+        if not _internal(key):
+            for content in self.contents:
+                if key in content:
+                    return content[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return not _internal(key) and \
+            any(key in content for content in self.contents)
+
+    def __iter__(self):
+        seen = set()
+        for content in self.contents:
+            for key in content:
+                if key not in seen and not _internal(key):
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+
+def _internal(key):
+    return hasattr(key, 'startswith') and key.startswith('_')
+
+
+def _merge_value(key, committed, new):
+    """Merge a value changed by two concurrent transactions."""
+    if key in (FINISHED_STEPS_KEY, LOADED_STEPS_KEY):
+        return committed | new
+    if key == REVISION_KEY:
+        # The merged data differs from both versions.
+        return max(committed, new) + 1
+    if isinstance(committed, dict) and isinstance(new, dict):
+        # The last writer wins for the data of a step, but a step which
+        # has been finished in one of the transactions stays finished.
+        merged = dict(new)
+        if committed.get('_finished', False) or new.get('_finished', False):
+            merged['_finished'] = True
+        return merged
+    return new
+
+
+def _resolve(old, committed, new, merge):
+    """Merge two concurrent changes of a dictionary, key by key."""
+    result = dict(committed)
+    for key in set(old) | set(committed) | set(new):
+        old_value = old.get(key, _marker)
+        committed_value = committed.get(key, _marker)
+        new_value = new.get(key, _marker)
+        if new_value == old_value:
+            # Only changed by the committed transaction, if at all.
+            continue
+        if committed_value != old_value and \
+                _marker not in (committed_value, new_value):
+            new_value = merge(key, committed_value, new_value)
+        if new_value is _marker:
+            result.pop(key, None)
+        else:
+            result[key] = new_value
+    return result
+
+
+class WizardData(Persistent):
+    """The data of a wizard, resolving conflicts between concurrent writes.
+
+    The contents of all steps are stored as plain dictionaries in a single
+    persistent object. Conflicting transactions (e.g. a wizard used in two
+    browser tabs) are merged per key: changes to different steps are both
+    kept, for the same step the last writer wins.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(value, PersistentMapping):
+            value = dict(value)
+        self.data[key] = value
+        self._p_changed = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self._p_changed = True
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def values(self):
+        return self.data.values()
+
+    def items(self):
+        return self.data.items()
+
+    def setdefault(self, key, default=None):
+        if key not in self.data:
+            self[key] = default
+        return self.data[key]
+
+    def _p_resolveConflict(self, old_state, committed_state, new_state):
+        state = dict(new_state)
+        state['data'] = _resolve(
+            old_state.get('data', {}),
+            committed_state.get('data', {}),
+            new_state.get('data', {}),
+            _merge_value,
+        )
+        return state
+
+
+@implementer(IWizardStorage)
+@adapter(IWizard)
+class MergingStorage(PersistentStorage):
+    """Store the wizard data as a conflict resolving object in the session.
+
+    Concurrent submits of the same wizard are merged per step instead of
+    raising a ConflictError, see ``WizardData``.
+    """
+
+    def create(self, key):
+        data = self.session[key] = WizardData()
+        return data
+
+    def sync(self, key, prefix=None):
+        data = self.get(key)
+        if data is not None:
+            data._p_changed = True
+
+
+def dump_content(content):
+    """Serialize the content of a step into a versioned blob.
+
+    Contents must only hold plain values, persistent objects are copied
+    into the blob.
+    """
+    return BLOB_VERSION + pickle.dumps(dict(content), 2)
+
+
+def load_content(blob):
+    """Return the content of a step serialized by dump_content."""
+    if blob[:1] != BLOB_VERSION:
+        raise ValueError('Unknown step content format.')
+    return pickle.loads(blob[1:])
+
+
+def _merge_blob(key, committed, new):
+    return dump_content(_merge_value(
+        key, load_content(committed), load_content(new),
+    ))
+
+
+class CompactData(WizardData):
+    """The data of a wizard with serialized step contents.
+
+    All steps of a wizard are kept in a single record. Step contents are
+    stored as versioned blobs, which are decoded on first access. Changed
+    contents are serialized again by ``flush``, the blobs of all other
+    steps are written as they are.
+    """
+
+    _v_contents = None
+
+    def __init__(self):
+        super(CompactData, self).__init__()
+        self.blobs = {}
+
+    def _contents(self):
+        if self._v_contents is None:
+            self._v_contents = {}
+        return self._v_contents
+
+    def __len__(self):
+        return len(self.data) + len(self.blobs)
+
+    def __iter__(self):
+        for key in self.data:
+            yield key
+        for key in self.blobs:
+            yield key
+
+    def __contains__(self, key):
+        return key in self.data or key in self.blobs
+
+    def __getitem__(self, key):
+        if key not in self.blobs:
+            return self.data[key]
+        contents = self._contents()
+        if key not in contents:
+            contents[key] = load_content(self.blobs[key])
+        return contents[key]
+
+    def __setitem__(self, key, value):
+        if not hasattr(value, 'keys'):
+            self.blobs.pop(key, None)
+            self._contents().pop(key, None)
+            super(CompactData, self).__setitem__(key, value)
+            return
+        self.data.pop(key, None)
+        self._contents()[key] = value
+        self.blobs[key] = dump_content(value)
+        self._p_changed = True
+
+    def __delitem__(self, key):
+        if key in self.blobs:
+            del self.blobs[key]
+            self._contents().pop(key, None)
+            self._p_changed = True
+        else:
+            super(CompactData, self).__delitem__(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def flush(self, key=None):
+        """Serialize the decoded step contents again, or the one under key.
+
+        Only blobs which actually changed mark the record as changed.
+        """
+        contents = self._contents()
+        names = list(contents) if key is None else [key]
+        for name in names:
+            if name not in contents:
+                continue
+            blob = dump_content(contents[name])
+            if blob != self.blobs.get(name):
+                self.blobs[name] = blob
+                self._p_changed = True
+
+    def _p_resolveConflict(self, old_state, committed_state, new_state):
+        state = super(CompactData, self)._p_resolveConflict(
+            old_state, committed_state, new_state,
+        )
+        state['blobs'] = _resolve(
+            old_state.get('blobs', {}),
+            committed_state.get('blobs', {}),
+            new_state.get('blobs', {}),
+            _merge_blob,
+        )
+        return state
+
+
+@implementer(IWizardStorage)
+@adapter(IWizard)
+class CompactStorage(MergingStorage):
+    """Store the wizard data as a single compact record in the session.
+
+    Step contents are serialized into blobs, see ``CompactData``. A change
+    writes a single object, re-serializing only the steps which changed.
+    Concurrent changes are merged like with the merging storage.
+    """
+
+    def create(self, key):
+        data = self.session[key] = CompactData()
+        return data
+
+    def sync(self, key, prefix=None):
+        data = self.get(key)
+        if data is None:
+            return
+        data.flush(prefix)
+        if prefix is None:
+            data._p_changed = True
+
+
+@implementer(IWizardStorage)
+@adapter(IWizard)
+class RAMStorage(object):
+    """Store the wizard data in memory.
+
+    The data is not shared between processes and gets lost on restart,
+    which makes this storage suitable for tests and stateless nodes. The
+    data is kept by the client id of the request, so an ``IClientId``
+    adapter must be registered. The least recently used entries are
+    dropped once ``maxsize`` is reached.
+    Users get a WizardIndex only while they have touched wizards.
+    """
+
+    maxsize = 1000
+
+    _data = collections.OrderedDict()
+    _indexes = {}
+    _lock = threading.Lock()
+
+    def __init__(self, wizard):
+        self.wizard = wizard
+
+    def _client_id(self):
+        # Without a client id, all users would share the same wizard data.
+        client_id = IClientId(self.wizard.request, None)
+        if not client_id:
+            raise ValueError(
+                'The RAM storage needs an IClientId adapter for the request '
+                'to keep the data of users apart.'
+            )
+        return str(client_id)
+
+    def _key(self, key):
+        return (self._client_id(), key)
+
+    @property
+    def index(self):
+        """The WizardIndex of the current user, or None if not created."""
+        return self._indexes.get(self._client_id(), None)
+
+    def _discard(self, client_id, key):
+        """Remove a key from the index of a user, dropping empty indexes."""
+        index = self._indexes.get(client_id, None)
+        if index is None:
+            return
+        index.discard(key)
+        if not index.entries:
+            del self._indexes[client_id]
+
+    def get(self, key, default=None):
+        key = self._key(key)
+        with self._lock:
+            try:
+                data = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = data
+        return data
+
+    def create(self, key):
+        key = self._key(key)
+        data = {}
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = data
+            while len(self._data) > self.maxsize:
+                (client_id, old_key), old_data = self._data.popitem(
+                    last=False,
+                )
+                self._discard(client_id, old_key)
+        return data
+
+    def remove(self, key):
+        with self._lock:
+            self._data.pop(self._key(key), None)
+            self._discard(self._client_id(), key)
+
+    def touch(self, key, ttl=None):
+        client_id = self._client_id()
+        with self._lock:
+            index = self._indexes.get(client_id, None)
+            if index is None:
+                index = self._indexes[client_id] = WizardIndex()
+            index.touch(key, ttl)
+
+    def expired(self, key):
+        with self._lock:
+            index = self.index
+            return index is not None and index.expired(key)
+
+    def sweep(self, max_entries=None):
+        client_id = self._client_id()
+        with self._lock:
+            index = self.index
+            if index is None:
+                return []
+            stale = index.stale(max_entries=max_entries)
+            for key in stale:
+                self._data.pop((client_id, key), None)
+                self._discard(client_id, key)
+        return stale
+
+    def sync(self, key, prefix=None):
+        pass
+
+    @classmethod
+    def clear(cls):
+        """Remove all data from the storage."""
+        with cls._lock:
+            cls._data.clear()
+            cls._indexes.clear()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Test fixtures for ps.zope.wizard."""
+
+# python imports
+import os
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# zope imports
+from persistent.dict import PersistentDict
+from z3c.form import (
+    datamanager,
+    field,
+    form,
+    testing,
+)
+from z3c.form.interfaces import IFormLayer
+from zope import schema
+from zope.component import (
+    provideAdapter,
+    provideUtility,
+)
+from zope.component import testing as placelesssetup
+from zope.interface import Interface
+from zope.pagetemplate.interfaces import IPageTemplate
+from zope.publisher.interfaces import IRequest
+from zope.session.http import CookieClientIdManager
+from zope.session.interfaces import (
+    IClientId,
+    IClientIdManager,
+    ISession,
+    ISessionDataContainer,
+)
+from zope.session.session import (
+    ClientId,
+    RAMSessionDataContainer,
+    Session,
+)
+from zope.site.folder import rootFolder
+from zope.traversing import testing as traversing_testing
+
+# local imports
+from ps.zope.wizard import (
+    jobs,
+    storage,
+)
+from ps.zope.wizard.interfaces import (
+    IWizardJobQueue,
+    IWizardJobRunner,
+)
+from ps.zope.wizard.wizard import (
+    Step,
+    Wizard,
+)
+
+
+STEP_TEMPLATE = os.path.join(os.path.dirname(__file__), 'tests', 'step.pt')
+
+
+def setUp(test=None):
+    """Register the components needed to update and render a wizard."""
+    placelesssetup.setUp()
+    traversing_testing.setUp()
+    testing.setupFormDefaults()
+
+    # Step contents are stored as (persistent) dictionaries.
+    provideAdapter(datamanager.DictionaryField)
+    provideAdapter(
+        datamanager.DictionaryField,
+        (PersistentDict, schema.interfaces.IField),
+    )
+    provideAdapter(
+        datamanager.DictionaryField,
+        (storage.StepContent, schema.interfaces.IField),
+    )
+    provideAdapter(
+        form.FormTemplateFactory(STEP_TEMPLATE, form=Step),
+        (None, IFormLayer),
+        IPageTemplate,
+    )
+
+    # A RAM based session, identified by a cookie.
+    provideUtility(
+        CookieClientIdManager(secret='ps.zope.wizard'),
+        IClientIdManager,
+    )
+    provideUtility(RAMSessionDataContainer(), ISessionDataContainer)
+    provideAdapter(ClientId, (IRequest,), IClientId)
+    provideAdapter(Session, (IRequest,), ISession)
+
+    # Storage backends, as registered in configure.zcml.
+    provideAdapter(storage.SessionStorage)
+    provideAdapter(storage.SessionStorage, name='session')
+    provideAdapter(storage.PersistentStorage, name='persistent')
+    provideAdapter(storage.MergingStorage, name='merging')
+    provideAdapter(storage.CompactStorage, name='compact')
+    provideAdapter(storage.RAMStorage, name='ram')
+
+    # Queued finish actions.
+    provideUtility(jobs.WizardJobQueue(), IWizardJobQueue)
+    provideUtility(jobs.InlineRunner(), IWizardJobRunner, name='inline')
+    provideUtility(jobs.ThreadRunner(), IWizardJobRunner, name='thread')
+    provideUtility(jobs.QueueRunner(), IWizardJobRunner, name='queue')
+
+
+def tearDown(test=None):
+    """Remove all registrations made during setUp."""
+    placelesssetup.tearDown()
+    storage.RAMStorage.clear()
+
+
+def make_request(form=None, cookies=None, **environ):
+    """Create a new form request, optionally sharing a session cookie."""
+    request = testing.TestRequest(form=form, **environ)
+    if cookies:
+        request._cookies.update(cookies)
+    return request
+
+
+def session_cookies(request):
+    """Return the session cookies set on the response of a request."""
+    return dict(
+        (name, value['value'])
+        for name, value in request.response._cookies.items()
+    )
+
+
+def make_step(index, field_count=5):
+    """Create a step class with a number of text line fields."""
+    attrs = {}
+    for num in range(field_count):
+        name = 'field_{0}'.format(num)
+        attrs[name] = schema.TextLine(title=name, required=False)
+    schema_class = type(Interface)(
+        'IStep{0}'.format(index), (Interface, ), attrs,
+    )
+    return type(
+        'Step{0}'.format(index),
+        (Step, ),
+        {
+            'prefix': 'step{0}'.format(index),
+            'label': u'Step {0}'.format(index),
+            'fields': field.Fields(schema_class),
+        },
+    )
+
+
+def make_wizard(step_count=3, field_count=5, base=Wizard):
+    """Create a wizard class with a number of generated steps."""
+    return type(
+        'TestWizard',
+        (base, ),
+        {
+            'steps': tuple(
+                make_step(index, field_count)
+                for index in range(step_count)
+            ),
+        },
+    )
+
+
+def make_context():
+    """Return a root folder, usable as a wizard context."""
+    return rootFolder()
+
+
+def wizard_view(wizard_class, context, request, name='wizard'):
+    """Instantiate a wizard view the way the publisher would do it."""
+    view = wizard_class(context, request)
+    view.__name__ = name
+    view.__parent__ = context
+    return view
+
+
+class WizardTestCase(unittest.TestCase):
+    """Base class for tests running requests against a wizard.
+
+    The requests share a wizard session by passing on the session cookie.
+    """
+
+    step_count = 3
+
+    def setUp(self):
+        setUp()
+        self.context = make_context()
+        self.wizard_class = make_wizard(step_count=self.step_count)
+        self.cookies = None
+
+    def tearDown(self):
+        tearDown()
+
+    def _request(self, form=None, **environ):
+        """Create a request with the session cookie of the former ones."""
+        return make_request(form=form, cookies=self.cookies, **environ)
+
+    def _keep_cookies(self, request):
+        self.cookies = session_cookies(request) or self.cookies
+
+    def _view(self, form=None, **environ):
+        """Update the wizard for a new request."""
+        request = self._request(form, **environ)
+        view = wizard_view(self.wizard_class, self.context, request)
+        view.update()
+        self._keep_cookies(request)
+        return view
+
+    def _render(self, form=None, **environ):
+        """Publish the wizard, returning the view, request and result."""
+        request = self._request(form, **environ)
+        view = wizard_view(self.wizard_class, self.context, request)
+        result = view()
+        self._keep_cookies(request)
+        return view, request, result
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the wizard request lifecycle.
+
+Run with ``python -m ps.zope.wizard.tests.benchmark``. Use ``--help`` to
+select the wizard sizes and operations.
+
+Each operation runs in its own request against a ZODB backed session (a
+MappingStorage) and is committed afterwards. The suite reports latency
+percentiles, the peak memory allocated during the operation (using
+tracemalloc, if available) and the number and size of the objects written
+to the ZODB.
+"""
+
+# python imports
+import argparse
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# zope imports
+import transaction
+from persistent.dict import PersistentDict
+from z3c.form.interfaces import IDataManager
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+from zope.component import (
+    getGlobalSiteManager,
+    getMultiAdapter,
+    provideUtility,
+)
+from zope.session.interfaces import ISessionDataContainer
+from zope.session.session import PersistentSessionDataContainer
+
+# local imports
+from ps.zope.wizard import testing
+from ps.zope.wizard.storage import (
+    FINISHED_STEPS_KEY,
+    LOADED_STEPS_KEY,
+    STEP_LAYOUT_KEY,
+)
+from ps.zope.wizard.traversal import WizardWidgetTraversal
+from ps.zope.wizard.wizard import (
+    Wizard,
+    apply_changes,
+)
+
+
+OPERATIONS = ('view', 'continue', 'back', 'jump', 'finish', 'traverse')
+
+
+class CountingStorage(MappingStorage):
+    """A MappingStorage counting the objects written."""
+
+    objects = 0
+    size = 0
+
+    def store(self, oid, serial, data, version, transaction):
+        self.objects += 1
+        self.size += len(data)
+        return MappingStorage.store(
+            self, oid, serial, data, version, transaction,
+        )
+
+    def reset(self):
+        self.objects = self.size = 0
+
+
+class EagerWizard(Wizard):
+    """A wizard which constructs all steps, like releases before 0.1."""
+
+    def update_active_steps(self):
+        super(EagerWizard, self).update_active_steps()
+        list(self.active_steps)
+
+
+def legacy_apply_changes(form, content, data):
+    """Apply changes looking up the datamanager of every field."""
+    changes = {}
+    for name, _field in form.fields.items():
+        if name not in data:
+            continue
+        dm = getMultiAdapter((content, _field.field), IDataManager)
+        if dm.query() != data[name]:
+            dm.set(data[name])
+            changes.setdefault(dm.field.interface, []).append(name)
+    return changes
+
+
+def percentile(values, percent):
+    """Return the percentile of a list of values (nearest rank)."""
+    values = sorted(values)
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+def calls_per_second(func, duration=2.0):
+    """Return the number of calls of func per second."""
+    number = 0
+    start = time.time()
+    while time.time() - start < duration:
+        func()
+        number += 1
+    return number / (time.time() - start)
+
+
+class WizardBench(object):
+    """Run requests of a generated wizard against a ZODB backed session."""
+
+    def __init__(self, step_count, field_count, wizard_base=Wizard,
+                 storage_name=u''):
+        self.step_count = step_count
+        self.field_count = field_count
+        self.wizard_class = testing.make_wizard(
+            step_count, field_count, base=wizard_base,
+        )
+        self.wizard_class.storage_name = storage_name
+        self.context = testing.make_context()
+        self.storage = CountingStorage()
+        self.db = DB(self.storage)
+        self.connection = self.db.open()
+        root = self.connection.root()
+        root['sessions'] = PersistentSessionDataContainer()
+        # Empty session containers compare equal, so the registered
+        # container must be removed explicitly.
+        getGlobalSiteManager().unregisterUtility(
+            provided=ISessionDataContainer,
+        )
+        provideUtility(root['sessions'], ISessionDataContainer)
+        self.cookies = None
+        self.view()
+        transaction.commit()
+
+    def close(self):
+        transaction.abort()
+        self.connection.close()
+        self.db.close()
+
+    def request(self, form=None):
+        request = testing.make_request(form=form, cookies=self.cookies)
+        wizard = testing.wizard_view(self.wizard_class, self.context, request)
+        return request, wizard
+
+    def view(self, form=None):
+        request, wizard = self.request(form)
+        wizard.update()
+        result = wizard.render()
+        self.cookies = testing.session_cookies(request) or self.cookies
+        return result
+
+    def submit(self, index, button):
+        form = dict(
+            ('step{0}.widgets.field_{1}'.format(index, num), u'value')
+            for num in range(self.field_count)
+        )
+        form['step{0}.buttons.{1}'.format(index, button)] = button
+        return self.view(form)
+
+    def prepare(self, index, finished=None):
+        """Store wizard data on step index, with all steps before finished.
+        """
+        if finished is None:
+            finished = index
+        request, wizard = self.request()
+        storage = wizard.storage
+        storage.remove(wizard.session_key)
+        data = storage.create(wizard.session_key)
+        for num in range(finished):
+            content = PersistentDict(
+                ('field_{0}'.format(field), u'value')
+                for field in range(self.field_count)
+            )
+            content['_finished'] = True
+            data['step{0}'.format(num)] = content
+        data['step'] = index
+        data[FINISHED_STEPS_KEY] = (1 << finished) - 1
+        data[LOADED_STEPS_KEY] = (1 << self.step_count) - 1
+        data[STEP_LAYOUT_KEY] = tuple(step.prefix for step in wizard.steps)
+        storage.sync(wizard.session_key)
+
+    # Operations. Each one prepares the session and returns the function
+    # to measure.
+
+    def op_view(self):
+        self.prepare(1)
+        return self.view
+
+    def op_continue(self):
+        self.prepare(0)
+        return lambda: self.submit(0, 'continue')
+
+    def op_back(self):
+        self.prepare(1)
+        return lambda: self.submit(1, 'back')
+
+    def op_jump(self):
+        self.prepare(1)
+        return lambda: self.view({'step': 0})
+
+    def op_finish(self):
+        last = self.step_count - 1
+        self.prepare(last)
+        return lambda: self.submit(last, 'finish')
+
+    def op_traverse(self):
+        self.prepare(1)
+
+        def traverse():
+            request, wizard = self.request()
+            WizardWidgetTraversal(wizard, request).traverse('field_0', [])
+        return traverse
+
+    def measure(self, operation, iterations):
+        """Run an operation and return a dictionary with the results."""
+        setup = getattr(self, 'op_' + operation)
+        timings = []
+        objects = 0
+        size = 0
+        for num in range(iterations):
+            func = setup()
+            transaction.commit()
+            self.storage.reset()
+            start = time.time()
+            func()
+            timings.append(time.time() - start)
+            transaction.commit()
+            objects += self.storage.objects
+            size += self.storage.size
+
+        allocated = None
+        if tracemalloc is not None:
+            func = setup()
+            transaction.commit()
+            tracemalloc.start()
+            func()
+            allocated = tracemalloc.get_traced_memory()[1] / 1024.0
+            tracemalloc.stop()
+            transaction.abort()
+
+        return {
+            'p50': percentile(timings, 50) * 1000,
+            'p90': percentile(timings, 90) * 1000,
+            'p99': percentile(timings, 99) * 1000,
+            'allocated': allocated,
+            'objects': float(objects) / iterations,
+            'bytes': float(size) / iterations,
+        }
+
+
+def run_suite(steps, fields, operations, iterations, storage_name=u''):
+    """Run the lifecycle benchmarks and print the results."""
+    print(
+        '{0:>5} {1:>6} {2:<9} {3:>8} {4:>8} {5:>8} {6:>9} {7:>7} '
+        '{8:>8}'.format(
+            'steps', 'fields', 'operation', 'p50 ms', 'p90 ms', 'p99 ms',
+            'peak KiB', 'objects', 'bytes',
+        ),
+    )
+    results = {}
+    for step_count in steps:
+        for field_count in fields:
+            bench = WizardBench(
+                step_count, field_count, storage_name=storage_name,
+            )
+            try:
+                for operation in operations:
+                    result = bench.measure(operation, iterations)
+                    results[(step_count, field_count, operation)] = result
+                    allocated = result['allocated']
+                    print(
+                        '{0:>5} {1:>6} {2:<9} {3:8.2f} {4:8.2f} {5:8.2f} '
+                        '{6:>9} {7:7.1f} {8:8.0f}'.format(
+                            step_count, field_count, operation,
+                            result['p50'], result['p90'], result['p99'],
+                            '-' if allocated is None else
+                            '{0:.1f}'.format(allocated),
+                            result['objects'], result['bytes'],
+                        ),
+                    )
+            finally:
+                bench.close()
+    return results
+
+
+def bench_lazy_steps(step_count=20, field_count=10):
+    """Compare eager and lazy step instantiation."""
+    results = []
+    for base in (EagerWizard, Wizard):
+        bench = WizardBench(step_count, field_count, wizard_base=base)
+        try:
+            bench.prepare(1)
+            transaction.commit()
+            results.append(calls_per_second(bench.view))
+        finally:
+            bench.close()
+    before, after = results
+    print('lazy steps ({0} steps, {1} fields each)'.format(
+        step_count, field_count,
+    ))
+    print('  eager: {0:8.1f} req/s'.format(before))
+    print('  lazy:  {0:8.1f} req/s ({1:.1f}x)'.format(after, after / before))
+
+
+def bench_apply_changes(field_count=50):
+    """Compare per field datamanager lookups with cached apply plans."""
+    step_class = testing.make_step(0, field_count)
+    step = step_class(testing.make_context(), None, None)
+    values = [
+        dict(
+            ('field_{0}'.format(num), u'{0}-{1}'.format(num, value))
+            for num in range(field_count)
+        )
+        for value in range(2)
+    ]
+    content = PersistentDict()
+
+    def submit(func):
+        def call():
+            for data in values:
+                func(step, content, data)
+        return call
+
+    before = calls_per_second(submit(legacy_apply_changes))
+    after = calls_per_second(submit(apply_changes))
+    print('apply changes ({0} fields, 2 submits per call)'.format(
+        field_count,
+    ))
+    print('  lookup per field: {0:8.1f} calls/s'.format(before))
+    print('  cached plan:      {0:8.1f} calls/s ({1:.1f}x)'.format(
+        after, after / before,
+    ))
+
+
+def bench_storage_layouts(step_count=20, field_count=10, iterations=20):
+    """Compare the objects and bytes written per commit by the storages."""
+    print('storage layouts ({0} steps, {1} fields each, per commit)'.format(
+        step_count, field_count,
+    ))
+    for storage_name in ('session', 'persistent', 'merging', 'compact'):
+        bench = WizardBench(
+            step_count, field_count, storage_name=storage_name,
+        )
+        try:
+            result = bench.measure('continue', iterations)
+            bench.prepare(step_count - 1)
+            transaction.commit()
+            request, wizard = bench.request()
+            data = wizard.storage.get(wizard.session_key)
+            size = sum(
+                len(bench.storage.load(oid)[0])
+                for oid in _oids(data)
+            )
+        finally:
+            bench.close()
+        print(
+            '  {0:<10} {1:5.1f} objects {2:8.0f} bytes, '
+            'all steps stored in {3:8d} bytes'.format(
+                storage_name, result['objects'], result['bytes'], size,
+            ),
+        )
+
+
+def _oids(data):
+    """Return the oids of the persistent objects holding wizard data."""
+    oids = []
+    if getattr(data, '_p_oid', None) is not None:
+        oids.append(data._p_oid)
+    for value in data.values():
+        if getattr(value, '_p_oid', None) is not None:
+            oids.append(value._p_oid)
+    return oids
+
+
+def _numbers(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for the wizard request lifecycle.',
+    )
+    parser.add_argument(
+        '--steps', type=_numbers, default=[3, 20, 100],
+        help='comma separated numbers of steps (default: 3,20,100)',
+    )
+    parser.add_argument(
+        '--fields', type=_numbers, default=[5, 50, 200],
+        help='comma separated numbers of fields per step (default: 5,50,200)',
+    )
+    parser.add_argument(
+        '--operations', type=lambda value: value.split(','),
+        default=list(OPERATIONS),
+        help='comma separated operations (default: {0})'.format(
+            ','.join(OPERATIONS),
+        ),
+    )
+    parser.add_argument(
+        '--iterations', type=int, default=20,
+        help='iterations per operation (default: 20)',
+    )
+    parser.add_argument(
+        '--storage', default=u'',
+        help='the name of the wizard storage (default: the unnamed one)',
+    )
+    parser.add_argument(
+        '--compare', action='store_true',
+        help='compare with the implementations of earlier releases',
+    )
+    args = parser.parse_args(argv)
+
+    testing.setUp()
+    try:
+        run_suite(
+            args.steps, args.fields, args.operations, args.iterations,
+            storage_name=args.storage,
+        )
+        if args.compare:
+            bench_lazy_steps()
+            bench_apply_changes()
+            bench_storage_layouts()
+    finally:
+        testing.tearDown()
+
+
+if __name__ == '__main__':
+    main()
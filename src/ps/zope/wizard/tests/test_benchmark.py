@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Make sure the benchmark suite keeps working."""
+
+# python imports
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# local imports
+from ps.zope.wizard import testing
+from ps.zope.wizard.tests import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    """Run the benchmark suite with a small wizard."""
+
+    def setUp(self):
+        testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_run_suite(self):
+        results = benchmark.run_suite([3], [5], benchmark.OPERATIONS, 1)
+        self.assertEqual(len(results), len(benchmark.OPERATIONS))
+        # Viewing a wizard doesn't write anything.
+        self.assertEqual(results[(3, 5, 'view')]['objects'], 0)
+        self.assertTrue(results[(3, 5, 'continue')]['objects'] > 0)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Test the wizard instrumentation."""
+
+# zope imports
+import zope.event
+from zope.component import provideUtility
+from zope.interface import implementer
+
+# local imports
+from ps.zope.wizard import testing
+from ps.zope.wizard.instrumentation import (
+    EventSink,
+    WizardPhaseEvent,
+)
+from ps.zope.wizard.interfaces import IWizardTimingSink
+
+
+@implementer(IWizardTimingSink)
+class RecordingSink(object):
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, wizard, timings, session_bytes):
+        self.records.append(([phase for phase, _ in timings], session_bytes))
+
+
+class TestInstrumentation(testing.WizardTestCase):
+    """Validate the timing of wizard phases."""
+
+    def _call(self, form=None):
+        view, request, result = self._render(form)
+        return view, request
+
+    def test_disabled(self):
+        view, request = self._call()
+        self.assertIsNone(view._timings)
+        self.assertIsNone(request.response.getHeader('Server-Timing'))
+
+    def test_sink(self):
+        sink = RecordingSink()
+        provideUtility(sink, IWizardTimingSink, name='recording')
+        self._call(form={'step0.buttons.continue': u'Continue'})
+        self.assertEqual(len(sink.records), 1)
+        phases, session_bytes = sink.records[0]
+        for phase in (
+            'update', 'update_active_steps', 'initialize', 'load_steps',
+            'update_current_step', 'handle_continue', 'sync', 'render',
+        ):
+            self.assertIn(phase, phases)
+        self.assertEqual(phases[-1], 'render')
+        self.assertTrue(session_bytes > 0)
+
+    def test_header(self):
+        self.wizard_class.timing_header = 'Server-Timing'
+        view, request = self._call()
+        header = request.response.getHeader('Server-Timing')
+        self.assertIn('update;dur=', header)
+        self.assertIn('render;dur=', header)
+
+    def test_event_sink(self):
+        events = []
+        zope.event.subscribers.append(events.append)
+        provideUtility(EventSink(), IWizardTimingSink, name='events')
+        try:
+            self._call()
+        finally:
+            zope.event.subscribers.remove(events.append)
+        phases = [
+            event.phase for event in events
+            if isinstance(event, WizardPhaseEvent)
+        ]
+        self.assertIn('update', phases)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Test the queued execution of wizard finish actions."""
+
+# python imports
+import json
+import time
+
+# zope imports
+import transaction
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+from ZODB.POSException import ConflictError
+from zope.component import (
+    getUtility,
+    provideAdapter,
+    provideUtility,
+)
+from zope.interface import Interface
+from zope.interface.verify import verifyClass
+
+# local imports
+from ps.zope.wizard import testing
+from ps.zope.wizard.interfaces import (
+    IWizardJob,
+    IWizardJobQueue,
+    IWizardJobRunner,
+)
+from ps.zope.wizard.jobs import (
+    DONE,
+    FAILED,
+    JOB_RETENTION,
+    PENDING,
+    InlineRunner,
+    JobStatus,
+    QueueRunner,
+    ThreadRunner,
+    WizardJob,
+    WizardJobQueue,
+    process_jobs,
+)
+from ps.zope.wizard.wizard import Wizard
+
+
+class FailingDataManager(object):
+    """Fail to commit the transaction it has joined."""
+
+    transaction_manager = transaction.manager
+
+    def abort(self, txn):
+        pass
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        pass
+
+    def tpc_vote(self, txn):
+        raise ValueError('commit failed')
+
+    def tpc_abort(self, txn):
+        pass
+
+    def tpc_finish(self, txn):
+        pass
+
+    def sortKey(self):
+        return 'failing'
+
+
+class TestJobs(testing.WizardTestCase):
+    """Validate queued finish actions."""
+
+    def setUp(self):
+        super(TestJobs, self).setUp()
+        self.applied = applied = []
+
+        class ApplyingStep(testing.make_step(0)):
+
+            def apply(self, context, **kw):
+                if self.getContent().get('field_0') == u'fail':
+                    raise ValueError('apply failed')
+                if self.getContent().get('field_0') == u'conflict':
+                    raise ConflictError()
+                if self.getContent().get('field_0') == u'uncommittable':
+                    transaction.get().join(FailingDataManager())
+                applied.append(dict(self.getContent()))
+
+        self.wizard_class = type('JobWizard', (Wizard, ), {
+            'steps': (ApplyingStep, ),
+            'job_runner': 'inline',
+        })
+        provideAdapter(
+            self.wizard_class, (None, None), Interface, name='wizard',
+        )
+
+    def tearDown(self):
+        transaction.abort()
+        super(TestJobs, self).tearDown()
+
+    def _finish(self, value=u'value'):
+        self._view()
+        view = self._view({
+            'step0.widgets.field_0': value,
+            'step0.buttons.finish': u'Finish',
+        })
+        self.assertTrue(view.finished)
+        job_id = view.next_url.split('?job=')[-1]
+        return view, getUtility(IWizardJobQueue).get(job_id)
+
+    def _status(self, job):
+        request = testing.make_request(form={'id': job.id})
+        return json.loads(JobStatus(self.context, request)())
+
+    def test_implementation(self):
+        verifyClass(IWizardJob, WizardJob)
+        verifyClass(IWizardJobQueue, WizardJobQueue)
+        for klass in (InlineRunner, ThreadRunner, QueueRunner):
+            verifyClass(IWizardJobRunner, klass)
+
+    def test_inline(self):
+        view, job = self._finish()
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(self.applied[0]['field_0'], u'value')
+        # The snapshot is dropped once the job has run.
+        self.assertIs(job.data, None)
+        self.assertEqual(self._status(job), {
+            'id': job.id,
+            'status': DONE,
+            'next_url': view.confirmation_page_url(),
+        })
+
+    def test_failed(self):
+        view, job = self._finish(u'fail')
+        self.assertEqual(job.status, FAILED)
+        self.assertIn('apply failed', job.error)
+        self.assertEqual(self._status(job)['status'], FAILED)
+
+    def test_unknown_job(self):
+        request = testing.make_request(form={'id': 'unknown'})
+        self.assertEqual(
+            json.loads(JobStatus(self.context, request)()), {'status': None},
+        )
+        self.assertEqual(request.response.getStatus(), 404)
+
+    def test_queue(self):
+        self.wizard_class.job_runner = 'queue'
+        view, job = self._finish()
+        self.assertEqual(job.status, PENDING)
+        self.assertEqual(self.applied, [])
+        queue = getUtility(IWizardJobQueue)
+        self.assertEqual(queue.pending(), [job])
+
+        self.assertEqual(process_jobs(request=testing.make_request()), 1)
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(self.applied[0]['field_0'], u'value')
+        self.assertEqual(queue.pending(), [])
+        self.assertEqual(queue.claim(job), None)
+
+    def _persistent_queue(self):
+        db = DB(MappingStorage())
+        connection = db.open()
+        connection.root()['queue'] = queue = WizardJobQueue()
+        provideUtility(queue, IWizardJobQueue)
+        self.addCleanup(db.close)
+        self.addCleanup(connection.close)
+        self.wizard_class.job_runner = 'queue'
+        return queue
+
+    def test_conflict(self):
+        queue = self._persistent_queue()
+        view, job = self._finish(u'conflict')
+        transaction.commit()
+        self.assertRaises(
+            ConflictError, job.run, request=testing.make_request(),
+        )
+        transaction.abort()
+        self.assertEqual(process_jobs(request=testing.make_request()), 0)
+        self.assertEqual(job.status, PENDING)
+        self.assertEqual(queue.pending(), [job])
+
+    def test_unknown_view(self):
+        queue = self._persistent_queue()
+        queue.add(WizardJob(self.context, 'unknown', {}))
+        view, job = self._finish()
+        transaction.commit()
+        self.assertEqual(process_jobs(request=testing.make_request()), 2)
+        failed = [item for item in queue.jobs.values() if item is not job]
+        self.assertEqual(failed[0].status, FAILED)
+        self.assertIn('ComponentLookupError', failed[0].error)
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(queue.pending(), [])
+
+    def test_commit_failure(self):
+        queue = self._persistent_queue()
+        view, job = self._finish(u'uncommittable')
+        view, other = self._finish()
+        transaction.commit()
+        self.assertEqual(process_jobs(request=testing.make_request()), 2)
+        self.assertEqual(job.status, FAILED)
+        self.assertIn('commit failed', job.error)
+        self.assertIs(job.data, None)
+        self.assertEqual(other.status, DONE)
+        self.assertEqual(queue.pending(), [])
+
+    def test_request_required(self):
+        self.assertRaises(ValueError, WizardJob(None, 'wizard', {}).run)
+
+    def test_purge(self):
+        self.wizard_class.job_runner = 'queue'
+        view, job = self._finish()
+        queue = getUtility(IWizardJobQueue)
+        process_jobs(request=testing.make_request())
+        self.assertIs(queue.get(job.id), job)
+        job.finished -= JOB_RETENTION + 1
+        self.assertEqual(process_jobs(request=testing.make_request()), 0)
+        self.assertIs(queue.get(job.id), None)
+
+    def test_thread(self):
+        self.wizard_class.job_runner = 'thread'
+        view, job = self._finish()
+        self.assertEqual(job.status, PENDING)
+        transaction.commit()
+        for num in range(100):
+            if job.status == DONE:
+                break
+            time.sleep(0.01)
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(self.applied[0]['field_0'], u'value')
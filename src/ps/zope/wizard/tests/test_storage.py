@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+"""Test the wizard storage backends."""
+
+# python imports
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# zope imports
+import transaction
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.MappingStorage import MappingStorage
+from zope.component import (
+    getGlobalSiteManager,
+    provideUtility,
+)
+from zope.interface.verify import verifyClass
+from zope.publisher.interfaces import IRequest
+from zope.session.interfaces import (
+    IClientId,
+    ISessionDataContainer,
+)
+from zope.session.session import (
+    PersistentSessionDataContainer,
+    RAMSessionDataContainer,
+)
+
+# local imports
+from ps.zope.wizard import testing
+from ps.zope.wizard.interfaces import IWizardStorage
+from ps.zope.wizard.storage import (
+    CompactData,
+    CompactStorage,
+    MergedData,
+    MergingStorage,
+    PersistentStorage,
+    RAMStorage,
+    SessionStorage,
+    StepContent,
+    WIZARD_SESSION_KEY,
+    WizardData,
+    sweep_sessions,
+)
+
+
+class StorageTestCase(testing.WizardTestCase):
+    """Base class running wizard requests against a storage."""
+
+    storage_name = u''
+
+    def setUp(self):
+        super(StorageTestCase, self).setUp()
+        self.wizard_class.storage_name = self.storage_name
+
+    def _continue(self, index, value):
+        return self._view(form={
+            'step{0}.widgets.field_0'.format(index): value,
+            'step{0}.buttons.continue'.format(index): u'Continue',
+        })
+
+
+class TestStorages(StorageTestCase):
+    """Validate the storage implementations."""
+
+    def test_implementation(self):
+        for klass in (
+            SessionStorage, PersistentStorage, MergingStorage,
+            CompactStorage, RAMStorage,
+        ):
+            verifyClass(IWizardStorage, klass)
+
+    def _check_roundtrip(self, storage_name):
+        self.wizard_class.storage_name = storage_name
+        self._continue(0, u'first')
+        view = self._view()
+        self.assertEqual(view.current_index, 1)
+        self.assertEqual(view.session['step0']['field_0'], u'first')
+
+        self._view(form={'step1.buttons.cancel': u'Cancel'})
+        self.assertIsNone(view.storage.get(view.session_key))
+
+    def test_session_storage(self):
+        self._check_roundtrip(u'session')
+
+    def test_persistent_storage(self):
+        self._check_roundtrip(u'persistent')
+
+    def test_merging_storage(self):
+        self._check_roundtrip(u'merging')
+
+    def test_compact_storage(self):
+        self._check_roundtrip(u'compact')
+
+    def test_ram_storage(self):
+        self._check_roundtrip(u'ram')
+
+    def test_ram_storage_requires_client_id(self):
+        self.wizard_class.storage_name = u'ram'
+        getGlobalSiteManager().unregisterAdapter(
+            required=(IRequest, ), provided=IClientId,
+        )
+        self.assertRaises(ValueError, self._view)
+        self.assertEqual(list(RAMStorage._data), [])
+
+    def test_ram_storage_evicts_least_recently_used(self):
+        self.wizard_class.storage_name = u'ram'
+        view = self._view()
+        storage = view.storage
+        self.assertIsInstance(storage, RAMStorage)
+        storage.maxsize = 2
+        storage.create('second')
+        storage.get(view.session_key)
+        storage.create('third')
+        self.assertIsNotNone(storage.get(view.session_key))
+        self.assertIsNone(storage.get('second'))
+
+
+class TestExpiry(StorageTestCase):
+    """Validate the expiry and eviction of abandoned wizards."""
+
+    def _age(self, view, seconds):
+        index = view.storage.index
+        for key, (touched, ttl) in list(index.entries.items()):
+            index.entries[key] = (touched - seconds, ttl)
+
+    def _check_ttl(self, storage_name):
+        self.wizard_class.storage_name = storage_name
+        self.wizard_class.session_ttl = 3600
+        view = self._continue(0, u'first')
+        self.assertEqual(view.current_index, 1)
+        self._age(view, 1800)
+        view = self._view()
+        self.assertEqual(view.current_index, 1)
+
+        self._age(view, 3601)
+        view = self._view()
+        self.assertEqual(view.current_index, 0)
+        self.assertNotIn('step0', view.session)
+
+    def test_session_ttl(self):
+        self._check_ttl(u'session')
+
+    def test_ram_ttl(self):
+        self._check_ttl(u'ram')
+
+    def _check_max_instances(self, storage_name):
+        self.wizard_class.storage_name = storage_name
+        self.wizard_class.max_instances = 2
+        views = []
+        for name in ('first', 'second', 'third'):
+            request = self._request()
+            view = testing.wizard_view(
+                self.wizard_class, self.context, request, name=name,
+            )
+            view.update()
+            self._keep_cookies(request)
+            views.append(view)
+            self._age(view, 10)
+        storage = views[-1].storage
+        self.assertIsNone(storage.get(views[0].session_key))
+        self.assertIsNotNone(storage.get(views[1].session_key))
+        self.assertIsNotNone(storage.get(views[2].session_key))
+
+    def test_session_max_instances(self):
+        self._check_max_instances(u'session')
+
+    def test_ram_max_instances(self):
+        self._check_max_instances(u'ram')
+
+    def test_sweep_sessions(self):
+        self.wizard_class.session_ttl = 60
+        view = self._view()
+        self._age(view, 61)
+        transaction.commit()
+        self.assertEqual(sweep_sessions(), 1)
+        self.assertIsNone(view.storage.get(view.session_key))
+        self.assertEqual(sweep_sessions(), 0)
+
+    def test_sweep_named_container(self):
+        # The wizard data and the index are kept in the container named
+        # after the wizards' session package.
+        provideUtility(
+            RAMSessionDataContainer(), ISessionDataContainer,
+            name=WIZARD_SESSION_KEY,
+        )
+        self.wizard_class.session_ttl = 60
+        view = self._view()
+        self._age(view, 61)
+        self.assertEqual(sweep_sessions(), 1)
+        self.assertIsNone(view.storage.get(view.session_key))
+
+    def test_untracked_wizards(self):
+        view = self._view()
+        self.assertIsNone(view.storage.index)
+
+    def test_ram_indexes_bounded(self):
+        self.wizard_class.storage_name = u'ram'
+        view = self._view(form={'step0.buttons.cancel': u'Cancel'})
+        self.assertIsNone(view.storage.index)
+        self.assertEqual(RAMStorage._indexes, {})
+
+        self.wizard_class.session_ttl = 60
+        view = self._view()
+        storage = view.storage
+        self.assertEqual(list(storage.index.entries), [view.session_key])
+        storage.maxsize = 1
+        storage.create('other')
+        self.assertIsNone(storage.get(view.session_key))
+        self.assertEqual(RAMStorage._indexes, {})
+
+
+class TestStepContent(StorageTestCase):
+    """Validate that reading step contents doesn't create them."""
+
+    def test_render_creates_no_step_contents(self):
+        view = self._view()
+        view.render()
+        self.assertEqual(
+            [key for key in view.session.keys() if key.startswith('step')],
+            ['step'],
+        )
+        content = view.current_step.getContent()
+        self.assertIsInstance(content, StepContent)
+        self.assertEqual(content.get('field_0'), None)
+        self.assertEqual(list(content.items()), [])
+
+    def test_write_creates_content(self):
+        view = self._view()
+        content = view.active_steps[1].getContent()
+        content['field_0'] = u'value'
+        self.assertIn('step1', view.session.dirty)
+        self.assertEqual(dict(view.session['step1']), {'field_0': u'value'})
+        self.assertIs(
+            view.active_steps[1].getContent(), view.session['step1'],
+        )
+
+
+class TestMergedData(StorageTestCase):
+    """Validate the merged view of the data of all steps."""
+
+    def test_get_all_data(self):
+        self._view()
+        self._continue(0, u'first')
+        view = self._continue(1, u'second')
+        self.assertNotIn('step2', view.session)
+        data = view.get_all_data()
+        self.assertEqual(data['field_0'], u'second')
+        self.assertEqual(sorted(data), [
+            'field_0', 'field_1', 'field_2', 'field_3', 'field_4',
+        ])
+        self.assertNotIn('_finished', data)
+        self.assertEqual(data.get('_finished'), None)
+        self.assertEqual(view.get_all_data('first')['field_0'], u'first')
+        self.assertRaises(ValueError, view.get_all_data, 'error')
+
+    def test_view(self):
+        first = {'a': 1, '_finished': True}
+        second = {'a': 2, 'b': 3}
+        data = MergedData([first, None, second])
+        self.assertEqual(sorted(data.items()), [('a', 2), ('b', 3)])
+        self.assertEqual(len(data), 2)
+        # Changes of the step contents are visible.
+        second['c'] = 4
+        self.assertEqual(data['c'], 4)
+        self.assertRaises(KeyError, data.__getitem__, '_finished')
+        self.assertEqual(dict(MergedData([first, second], 'first'))['a'], 1)
+        self.assertEqual(
+            dict(MergedData([{'a': 1}, {'b': 2}], 'error')), {'a': 1, 'b': 2},
+        )
+        self.assertRaises(ValueError, MergedData, [], 'unknown')
+
+
+class ZODBStorageTestCase(StorageTestCase):
+    """Base class storing the sessions in a ZODB."""
+
+    def setUp(self):
+        super(ZODBStorageTestCase, self).setUp()
+        self.db = DB(MappingStorage())
+        self.connection = self.db.open()
+        root = self.connection.root()
+        root['sessions'] = PersistentSessionDataContainer()
+        # Empty session containers compare equal, so the RAM container
+        # registered by the test setup must be removed explicitly.
+        getGlobalSiteManager().unregisterUtility(
+            provided=ISessionDataContainer,
+        )
+        provideUtility(root['sessions'], ISessionDataContainer)
+        transaction.commit()
+
+    def tearDown(self):
+        transaction.abort()
+        self.connection.close()
+        self.db.close()
+        super(ZODBStorageTestCase, self).tearDown()
+
+    def _assert_no_write(self, func, *args, **kw):
+        last_transaction = self.db.lastTransaction()
+        func(*args, **kw)
+        transaction.commit()
+        self.assertEqual(self.db.lastTransaction(), last_transaction)
+
+
+class TestPersistentStorage(ZODBStorageTestCase):
+    """Validate that the persistent storage only writes touched steps."""
+
+    storage_name = u'persistent'
+
+    def test_only_touched_step_is_written(self):
+        self._continue(0, u'first')
+        self._continue(1, u'second')
+        self._view(form={'step': 1})
+        transaction.commit()
+
+        view = self._continue(1, u'changed')
+        session = view.storage.session
+        self.assertFalse(session._p_changed)
+        self.assertFalse(view.session['step0']._p_changed)
+        self.assertTrue(view.session['step1']._p_changed)
+
+
+class TestDirtyTracking(ZODBStorageTestCase):
+    """Validate that only changed data gets written."""
+
+    def _check_read_only_get(self, storage_name):
+        self.wizard_class.storage_name = storage_name
+        self._continue(0, u'first')
+        self._view().render()
+        transaction.commit()
+
+        self._assert_no_write(lambda: self._view().render())
+        self._assert_no_write(self._view, form={'step': 1})
+
+        # Submitting unchanged data only changes the current step.
+        self._continue(0, u'first')
+        transaction.commit()
+        self._assert_no_write(self._continue, 0, u'first')
+
+    def test_session_storage(self):
+        self._check_read_only_get(u'session')
+
+    def test_persistent_storage(self):
+        self._check_read_only_get(u'persistent')
+
+    def test_merging_storage(self):
+        self._check_read_only_get(u'merging')
+
+    def test_compact_storage(self):
+        self._check_read_only_get(u'compact')
+
+
+class TestCompactStorage(ZODBStorageTestCase):
+    """Validate that the compact storage only serializes changed steps."""
+
+    storage_name = u'compact'
+
+    def test_only_changed_step_is_serialized(self):
+        self._continue(0, u'first')
+        self._continue(1, u'second')
+        view = self._view(form={'step': 1})
+        transaction.commit()
+        data = view.storage.get(view.session_key)
+        self.assertIsInstance(data, CompactData)
+        self.assertEqual(sorted(data.blobs), ['step0', 'step1'])
+        blob = data.blobs['step0']
+
+        view = self._continue(1, u'changed')
+        data = view.storage.get(view.session_key)
+        self.assertIs(data.blobs['step0'], blob)
+        self.assertEqual(data['step1']['field_0'], u'changed')
+        transaction.commit()
+
+        # Only the record holding the data of all steps has been written.
+        last = list(self.db.storage.iterator())[-1]
+        self.assertEqual([record.oid for record in last], [data._p_oid])
+
+
+class TestFinishedState(ZODBStorageTestCase):
+    """Validate that the finished state of steps is stored."""
+
+    def _reload(self):
+        transaction.commit()
+        # Drop the objects read so far, so the next request reads the
+        # stored data.
+        self.connection.cacheMinimize()
+
+    def _check_unfinished(self, storage_name):
+        self.wizard_class.storage_name = storage_name
+        self._view()
+        self._continue(0, u'first')
+        self._reload()
+        self._view(form={'step': 0})
+        self._reload()
+        view = self._continue(0, u'invalid\nvalue')
+        self.assertEqual(view.current_index, 0)
+        self._reload()
+
+        view = self._view()
+        self.assertEqual(view.finished_steps, 0)
+        self.assertFalse(view.session['step0']['_finished'])
+        self.assertFalse(view.active_steps.finished(0))
+
+    def test_session_storage(self):
+        self._check_unfinished(u'session')
+
+    def test_compact_storage(self):
+        self._check_unfinished(u'compact')
+
+
+class TestWizardData(unittest.TestCase):
+    """Validate the conflict resolution of concurrent wizard submits."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db = DB(FileStorage(os.path.join(self.tempdir, 'Data.fs')))
+        connection = self.db.open()
+        data = connection.root()['wizard'] = WizardData()
+        data['step'] = 0
+        data['step0'] = {'_finished': False}
+        transaction.commit()
+        connection.close()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def _open(self, name='wizard'):
+        manager = transaction.TransactionManager()
+        connection = self.db.open(manager)
+        return manager, connection, connection.root()[name]
+
+    def test_merge_different_steps(self):
+        tm1, conn1, data1 = self._open()
+        tm2, conn2, data2 = self._open()
+        data1['step0'] = {'name': u'first', '_finished': True}
+        data1['step'] = 1
+        data2['step1'] = {'city': u'second', '_finished': False}
+        data2['step'] = 2
+        tm1.commit()
+        tm2.commit()
+
+        tm3, conn3, data3 = self._open()
+        self.assertEqual(data3['step'], 2)
+        self.assertEqual(
+            data3['step0'], {'name': u'first', '_finished': True},
+        )
+        self.assertEqual(
+            data3['step1'], {'city': u'second', '_finished': False},
+        )
+        for connection in (conn1, conn2, conn3):
+            connection.close()
+
+    def test_same_step_last_writer_wins(self):
+        tm1, conn1, data1 = self._open()
+        tm2, conn2, data2 = self._open()
+        data1['step0'] = {'name': u'first', '_finished': True}
+        data2['step0'] = {'name': u'second', '_finished': False}
+        tm1.commit()
+        tm2.commit()
+
+        tm3, conn3, data3 = self._open()
+        self.assertEqual(
+            data3['step0'], {'name': u'second', '_finished': True},
+        )
+        for connection in (conn1, conn2, conn3):
+            connection.close()
+
+    def test_compact_data(self):
+        connection = self.db.open()
+        data = connection.root()['compact'] = CompactData()
+        data['step'] = 0
+        data['step0'] = {'_finished': False}
+        transaction.commit()
+        connection.close()
+
+        tm1, conn1, data1 = self._open('compact')
+        tm2, conn2, data2 = self._open('compact')
+        data1['step0']['name'] = u'first'
+        data1['step0']['_finished'] = True
+        data1.flush('step0')
+        data2['step1'] = {'city': u'second'}
+        data2['step'] = 1
+        tm1.commit()
+        tm2.commit()
+
+        tm3, conn3, data3 = self._open('compact')
+        self.assertEqual(data3['step'], 1)
+        self.assertEqual(
+            data3['step0'], {'name': u'first', '_finished': True},
+        )
+        self.assertEqual(data3['step1'], {'city': u'second'})
+        for connection in (conn1, conn2, conn3):
+            connection.close()
+
+    def test_finished_steps_are_combined(self):
+        tm1, conn1, data1 = self._open()
+        tm2, conn2, data2 = self._open()
+        data1['_finished_steps'] = 1
+        data2['_finished_steps'] = 2
+        tm1.commit()
+        tm2.commit()
+
+        tm3, conn3, data3 = self._open()
+        self.assertEqual(data3['_finished_steps'], 3)
+        for connection in (conn1, conn2, conn3):
+            connection.close()
+
+    def test_parallel_submits(self):
+        errors = []
+        start = threading.Event()
+
+        def submit(index):
+            manager, connection, data = self._open()
+            start.wait()
+            try:
+                for num in range(20):
+                    manager.begin()
+                    prefix = 'step{0}'.format(index)
+                    data[prefix] = {'count': num, '_finished': True}
+                    data['step'] = index
+                    manager.commit()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=submit, args=(index, ))
+            for index in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        manager, connection, data = self._open()
+        for index in range(5):
+            self.assertEqual(
+                data['step{0}'.format(index)],
+                {'count': 19, '_finished': True},
+            )
+        connection.close()
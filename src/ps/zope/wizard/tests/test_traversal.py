@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Test widget traversal."""
+
+# zope imports
+from z3c.form import field
+from z3c.form.browser.multi import multiFieldWidgetFactory
+from zope import schema
+from zope.interface import Interface
+from zope.traversing.interfaces import TraversalError
+
+# local imports
+from ps.zope.wizard import testing
+from ps.zope.wizard.traversal import WizardWidgetTraversal
+
+
+class IGrid(Interface):
+
+    rows = schema.List(
+        title=u'Rows',
+        value_type=schema.TextLine(title=u'Row'),
+        required=False,
+    )
+
+
+class GridStep(testing.make_step(0)):
+    """A step with a MultiWidget, adding a template row like DataGridField.
+    """
+
+    fields = field.Fields(IGrid)
+    fields['rows'].widgetFactory = multiFieldWidgetFactory
+
+    def update(self):
+        super(GridStep, self).update()
+        grid = self.widgets['rows']
+        grid.prefix = grid.name
+        grid.widgets.append(grid.getWidget('TT'))
+
+
+class DuplicateGridStep(GridStep):
+    """A step whose MultiWidget has two template rows."""
+
+    def update(self):
+        super(DuplicateGridStep, self).update()
+        grid = self.widgets['rows']
+        grid.widgets.append(grid.getWidget('TT'))
+
+
+class TestWizardWidgetTraversal(testing.WizardTestCase):
+    """Validate the ++widget++ traversal."""
+
+    step_count = 5
+
+    def setUp(self):
+        super(TestWizardWidgetTraversal, self).setUp()
+        # Start a wizard session.
+        self._view()
+
+    def _traverse(self, name):
+        request = self._request()
+        view = testing.wizard_view(self.wizard_class, self.context, request)
+        traverser = WizardWidgetTraversal(view, request)
+        return view, traverser.traverse(name, [])
+
+    def test_current_step_widget(self):
+        view, widget = self._traverse('field_1')
+        self.assertEqual(widget.name, 'step0.widgets.field_1')
+        self.assertIs(widget.__parent__, view)
+
+    def test_step_widget_by_prefix(self):
+        view, widget = self._traverse('step3.widgets.field_2')
+        self.assertEqual(widget.name, 'step3.widgets.field_2')
+        steps = view.active_steps
+        self.assertEqual(
+            [steps.is_instantiated(idx) for idx in range(len(steps))],
+            [True, False, False, True, False],
+        )
+
+    def test_unknown_widget(self):
+        self.assertRaises(TraversalError, self._traverse, 'missing')
+        self.assertRaises(
+            TraversalError, self._traverse, 'step3.widgets.missing',
+        )
+
+    def test_multi_widget(self):
+        self.wizard_class.steps = (GridStep, ) + self.wizard_class.steps[1:]
+        self.cookies = None
+        request = self._request({
+            'step0.widgets.rows.count': u'2',
+            'step0.widgets.rows.0': u'first',
+            'step0.widgets.rows.1': u'second',
+        })
+        view = testing.wizard_view(self.wizard_class, self.context, request)
+        traverser = WizardWidgetTraversal(view, request)
+        widget = traverser.traverse('rows.1', [])
+        self.assertEqual(widget.name, 'step0.widgets.rows.1')
+        widget = traverser.traverse('step0.widgets.rows.TT', [])
+        self.assertEqual(widget.name, 'step0.widgets.rows.TT')
+        self.assertRaises(TraversalError, traverser.traverse, 'rows.AA', [])
+        self.assertRaises(TraversalError, traverser.traverse, 'rows.5', [])
+
+    def test_duplicate_rows(self):
+        self.wizard_class.steps = (
+            DuplicateGridStep,
+        ) + self.wizard_class.steps[1:]
+        self.cookies = None
+        request = self._request()
+        view = testing.wizard_view(self.wizard_class, self.context, request)
+        traverser = WizardWidgetTraversal(view, request)
+        self.assertRaises(TraversalError, traverser.traverse, 'rows.TT', [])
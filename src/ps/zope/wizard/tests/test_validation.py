@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Test the inline validation of wizard steps."""
+
+# python imports
+import json
+
+# zope imports
+from z3c.form import field
+from zope import schema
+from zope.interface import Interface
+
+# local imports
+from ps.zope.wizard import testing
+from ps.zope.wizard.validation import WizardValidation
+from ps.zope.wizard.wizard import Wizard
+
+
+class IContact(Interface):
+
+    name = schema.TextLine(title=u'Name')
+
+    age = schema.Int(title=u'Age', required=False)
+
+
+class TestValidation(testing.WizardTestCase):
+    """Validate the @@wizard-validate view."""
+
+    def setUp(self):
+        super(TestValidation, self).setUp()
+        self.loaded = loaded = []
+
+        class ContactStep(testing.make_step(1)):
+            fields = field.Fields(IContact)
+
+            def load(self, context, **kw):
+                loaded.append(self.prefix)
+
+        self.wizard_class = type('ValidatedWizard', (Wizard, ), {
+            'steps': (testing.make_step(0), ContactStep),
+            'lazy_load': True,
+        })
+
+    def _validate(self, form):
+        request = self._request(form)
+        wizard = testing.wizard_view(self.wizard_class, self.context, request)
+        result = json.loads(WizardValidation(wizard, request)())
+        return wizard, request, result
+
+    def test_errors(self):
+        wizard, request, result = self._validate({
+            'prefix': 'step1',
+            'step1.widgets.age': u'old',
+        })
+        self.assertEqual(result['prefix'], 'step1')
+        self.assertEqual(list(result['errors']), ['step1.widgets.age'])
+        # Only the widgets of the validated fields are updated.
+        self.assertEqual(list(wizard.active_steps[1].widgets), ['age'])
+        self.assertFalse(wizard.active_steps.is_instantiated(0))
+        self.assertEqual(self.loaded, [])
+
+    def test_valid(self):
+        wizard, request, result = self._validate({
+            'prefix': 'step1',
+            'step1.widgets.name': u'Jane',
+            'step1.widgets.age': u'42',
+        })
+        self.assertEqual(result['errors'], {})
+
+    def test_fields(self):
+        wizard, request, result = self._validate({
+            'prefix': 'step1',
+            'fields': 'name,age',
+        })
+        self.assertEqual(list(result['errors']), ['step1.widgets.name'])
+
+    def test_current_step(self):
+        wizard, request, result = self._validate({})
+        self.assertEqual(result, {'prefix': 'step0', 'errors': {}})
+
+    def test_unknown_step(self):
+        wizard, request, result = self._validate({'prefix': 'unknown'})
+        self.assertEqual(request.response.getStatus(), 404)
+
+    def test_session_unchanged(self):
+        wizard = self._view()
+        data = dict(wizard.storage.get(wizard.session_key))
+
+        wizard, request, result = self._validate({
+            'prefix': 'step1',
+            'step1.widgets.name': u'Jane',
+        })
+        self.assertEqual(result['errors'], {})
+        self.assertEqual(dict(wizard.storage.get(wizard.session_key)), data)
+        self.assertEqual(wizard.session.dirty, set())
+        self.assertNotIn('step1', wizard.session)
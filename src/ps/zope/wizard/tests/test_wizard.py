@@ -2,22 +2,45 @@
 """Test wizards."""
 
 # python imports
+import json
+import threading
+
 try:
     import unittest2 as unittest
 except ImportError:
     import unittest
 
 # zope imports
+import transaction
+from persistent.dict import PersistentDict
+from persistent.mapping import PersistentMapping
+from z3c.form.datamanager import DictionaryField
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+from ZODB.POSException import ConflictError
+from zope.component import (
+    provideAdapter,
+    provideHandler,
+)
 from zope.interface.verify import verifyClass
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.schema.interfaces import IField
 
 # local imports
+from ps.zope.wizard import testing
 from ps.zope.wizard.interfaces import (
     IStep,
     IWizard,
 )
 from ps.zope.wizard.wizard import (
+    ApplyError,
     Step,
     Wizard,
+    _step_paths,
+    apply_changes,
+    chameleon_template,
+    compute_step_path,
+    get_apply_plan,
 )
 
 
@@ -29,3 +52,748 @@ class TestWizard(unittest.TestCase):
 
     def test_wizard_implementation(self):
         verifyClass(IWizard, Wizard)
+
+
+class TestLazySteps(testing.WizardTestCase):
+    """Validate the lazy instantiation of wizard steps."""
+
+    step_count = 5
+
+    def test_only_current_step_is_instantiated(self):
+        self._view()
+        view = self._view()
+        view.render()
+        steps = view.active_steps
+        self.assertEqual(len(steps), 5)
+        self.assertTrue(steps.is_instantiated(0))
+        for index in range(1, 5):
+            self.assertFalse(steps.is_instantiated(index))
+        self.assertIs(steps[0], view.current_step)
+
+    def test_metadata_without_instantiation(self):
+        self._view()
+        view = self._view()
+        steps = view.active_steps
+        self.assertEqual(steps.label(3), u'Step 3')
+        self.assertEqual(steps.prefix(3), 'step3')
+        self.assertFalse(steps.finished(3))
+        self.assertFalse(view.all_steps_finished)
+        self.assertFalse(steps.is_instantiated(3))
+
+    def test_jump_only_to_finished_steps(self):
+        view = self._view(form={
+            'step0.widgets.field_0': u'value',
+            'step0.buttons.continue': u'Continue',
+        })
+        self.assertEqual(view.current_index, 1)
+        self.assertTrue(view.active_steps.finished(0))
+
+        view = self._view(form={'step': 3})
+        self.assertEqual(view.current_index, 1)
+        view = self._view(form={'step': 10})
+        self.assertEqual(view.current_index, 1)
+        view = self._view(form={'step': 0})
+        self.assertEqual(view.current_index, 0)
+
+
+class TestFinishedSteps(testing.WizardTestCase):
+    """Validate the finished steps bitmap."""
+
+    def _continue(self, index):
+        return self._view(form={
+            'step{0}.buttons.continue'.format(index): u'Continue',
+        })
+
+    def test_bitmap(self):
+        view = self._view()
+        self.assertEqual(view.finished_steps, 0)
+        view = self._continue(0)
+        self.assertEqual(view.finished_steps, 1)
+        view = self._continue(1)
+        self.assertEqual(view.finished_steps, 3)
+        self.assertFalse(view.all_steps_finished)
+        self.assertTrue(view.show_finish())
+
+    def test_checks_are_side_effect_free(self):
+        view = self._view()
+        keys = set(view.session.keys())
+        dirty = set(view.session.dirty)
+        self.assertFalse(view.all_steps_finished)
+        self.assertFalse(view.active_steps.finished(2))
+        self.assertFalse(view.active_steps[2].finished)
+        self.assertEqual(set(view.session.keys()), keys)
+        self.assertEqual(view.session.dirty, dirty)
+
+    def test_custom_finished_property(self):
+        class AlwaysFinished(self.wizard_class.steps[1]):
+            finished = True
+
+        self.wizard_class.steps = (
+            self.wizard_class.steps[0], AlwaysFinished,
+        )
+        view = self._continue(0)
+        self.assertTrue(view.active_steps.finished(1))
+        self.assertTrue(view.all_steps_finished)
+
+    def test_reordered_steps(self):
+        self._view()
+        view = self._continue(0)
+        self.assertEqual(view.finished_steps, 1)
+
+        # A new version of the wizard inserts a step before the first one.
+        self.wizard_class.steps = (
+            testing.make_step(3),
+        ) + self.wizard_class.steps
+        view = self._view()
+        self.assertEqual(view.finished_steps, 2)
+        self.assertFalse(view.active_steps.finished(0))
+        self.assertTrue(view.active_steps.finished(1))
+
+
+class TestNavigation(testing.WizardTestCase):
+    """Validate the navigation model."""
+
+    def test_navigation(self):
+        self._view()
+        view = self._view({'step0.buttons.continue': u'Continue'})
+        navigation = view.navigation
+        self.assertIs(view.navigation, navigation)
+        url = 'http://127.0.0.1/wizard?step:int={0}'
+        self.assertEqual(navigation, (
+            (0, u'Step 0', url.format(0), 'finished'),
+            (1, u'Step 1', url.format(1), 'current'),
+            (2, u'Step 2', url.format(2), 'pending'),
+        ))
+        html = view.render()
+        self.assertIn('href="{0}"'.format(url.format(0)), html)
+        self.assertNotIn(url.format(1), html)
+        self.assertIn('class="wizard-step-link selected"', html)
+
+    def test_redirect_navigation(self):
+        self.wizard_class.redirect_navigation = True
+        self._view()
+        request = self._request({'step0.buttons.continue': u'Continue'})
+        view = testing.wizard_view(self.wizard_class, self.context, request)
+        view.update()
+        self.assertEqual(view.render(), u'')
+        self.assertEqual(request.response.getStatus(), 302)
+        self.assertEqual(
+            request.response.getHeader('Location'),
+            'http://127.0.0.1/wizard?step:int=1',
+        )
+        # The new step is only updated by the following request.
+        self.assertFalse(view.active_steps.is_instantiated(1))
+
+        view = self._view({'step': 1})
+        self.assertEqual(view.current_index, 1)
+        self.assertIn('step1.buttons.back', view.render())
+
+    @unittest.skipIf(chameleon_template is None, 'z3c.pt is not installed')
+    def test_chameleon_template(self):
+        self._view()
+        view = self._view({'step0.buttons.continue': u'Continue'})
+        html = view.render()
+        self.wizard_class.template = chameleon_template
+        compiled = view.render()
+        self.assertIn('http://127.0.0.1/wizard?step:int=0', compiled)
+        self.assertEqual(
+            compiled.split('<ul')[1].split(),
+            html.split('<ul')[1].split(),
+        )
+
+
+class TestFragment(testing.WizardTestCase):
+    """Validate rendering the current step only."""
+
+    def test_header(self):
+        view, request, result = self._render(HTTP_X_WIZARD_FRAGMENT='1')
+        self.assertEqual(
+            request.response.getHeader('Content-Type'), 'application/json',
+        )
+        state = json.loads(result)
+        self.assertEqual(state['index'], 0)
+        self.assertEqual(state['count'], 3)
+        self.assertEqual(state['prefix'], 'step0')
+        self.assertEqual(state['finished'], [False, False, False])
+        self.assertEqual(state['next_url'], None)
+        self.assertIn('step0.buttons.continue', state['html'])
+        self.assertNotIn('wizard-steps', state['html'])
+        self.assertIs(view._navigation, None)
+
+    def test_parameter(self):
+        self._render()
+        view, request, result = self._render({
+            'step0.buttons.continue': u'Continue',
+            'fragment': '1',
+        })
+        state = json.loads(result)
+        self.assertEqual(state['index'], 1)
+        self.assertEqual(state['finished'], [True, False, False])
+        self.assertIn('step1.buttons.back', state['html'])
+
+    def test_next_url(self):
+        self.wizard_class.redirect_navigation = True
+        self._render()
+        view, request, result = self._render({
+            'step0.buttons.continue': u'Continue',
+            'fragment': '1',
+        })
+        state = json.loads(result)
+        self.assertEqual(
+            state['next_url'], 'http://127.0.0.1/wizard?step:int=1',
+        )
+        self.assertEqual(state['html'], u'')
+        self.assertNotEqual(request.response.getStatus(), 302)
+
+    def test_full_page(self):
+        view, request, result = self._render()
+        self.assertIn('wizard-steps', result)
+
+    def test_cancel(self):
+        self._render()
+        view, request, result = self._render({
+            'step0.buttons.cancel': u'Cancel',
+            'fragment': '1',
+        })
+        self.assertNotEqual(request.response.getStatus(), 302)
+        state = json.loads(result)
+        self.assertEqual(state['next_url'], 'http://127.0.0.1')
+        self.assertEqual(state['html'], u'')
+
+        self._render()
+        view, request, result = self._render({
+            'step0.buttons.cancel': u'Cancel',
+        })
+        self.assertEqual(request.response.getStatus(), 302)
+        self.assertEqual(
+            request.response.getHeader('Location'), 'http://127.0.0.1',
+        )
+
+
+class TestETag(testing.WizardTestCase):
+    """Validate answering conditional requests."""
+
+    def setUp(self):
+        super(TestETag, self).setUp()
+        self.wizard_class.etag_caching = True
+
+    def _render(self, form=None, etag=None, **environ):
+        if etag is not None:
+            environ['HTTP_IF_NONE_MATCH'] = etag
+        return super(TestETag, self)._render(form, **environ)
+
+    def test_not_modified(self):
+        view, request, result = self._render()
+        etag = request.response.getHeader('ETag')
+        self.assertTrue(etag)
+        self.assertEqual(
+            request.response.getHeader('Cache-Control'), 'private, no-cache',
+        )
+
+        view, request, result = self._render(etag=etag)
+        self.assertEqual(request.response.getStatus(), 304)
+        self.assertEqual(result, '')
+        self.assertIs(view.current_step, None)
+        self.assertEqual(request.response.getHeader('ETag'), etag)
+
+    def test_modified(self):
+        view, request, result = self._render()
+        etag = request.response.getHeader('ETag')
+        view, request, result = self._render(
+            {'step0.buttons.continue': u'Continue'}, etag=etag,
+            REQUEST_METHOD='POST',
+        )
+        self.assertIn('step1.buttons.back', result)
+        new_etag = request.response.getHeader('ETag')
+        self.assertNotEqual(new_etag, etag)
+
+        view, request, result = self._render(etag=etag)
+        self.assertIn('step1.buttons.back', result)
+        view, request, result = self._render(etag=new_etag)
+        self.assertEqual(request.response.getStatus(), 304)
+
+    def test_fragment(self):
+        view, request, result = self._render()
+        etag = request.response.getHeader('ETag')
+        view, request, result = self._render(
+            {'fragment': '1'}, etag=etag,
+        )
+        self.assertIn('step0.buttons.continue', json.loads(result)['html'])
+        fragment_etag = request.response.getHeader('ETag')
+        self.assertNotEqual(fragment_etag, etag)
+        self.assertEqual(
+            request.response.getHeader('Cache-Control'), 'private, no-cache',
+        )
+        view, request, result = self._render(
+            {'fragment': '1'}, etag=fragment_etag,
+        )
+        self.assertEqual(request.response.getStatus(), 304)
+
+    def test_disabled(self):
+        self.wizard_class.etag_caching = False
+        view, request, result = self._render()
+        self.assertEqual(request.response.getHeader('ETag'), None)
+        self.assertNotIn('_revision', view.session)
+
+
+def _offer(wizard):
+    return wizard.session.get('step0', {}).get('field_0', None)
+
+
+class TestStepPath(testing.WizardTestCase):
+    """Validate conditional steps and branches."""
+
+    step_count = 4
+
+    def setUp(self):
+        super(TestStepPath, self).setUp()
+        self.calls = calls = []
+
+        def condition(offer):
+            def check(wizard):
+                calls.append(offer)
+                return _offer(wizard) == offer
+            return check
+
+        steps = self.wizard_class.steps
+        steps[1].condition = condition(u'rent')
+        steps[1].depends_on = [('step0', 'field_0')]
+        steps[2].condition = condition(u'sale')
+        steps[2].depends_on = [('step0', 'field_0')]
+
+    def tearDown(self):
+        _step_paths.clear()
+        super(TestStepPath, self).tearDown()
+
+    def _labels(self, view):
+        return [item[1] for item in view.navigation]
+
+    def test_branch(self):
+        view = self._view()
+        self.assertEqual(
+            self._labels(view), [u'Step 0', u'Step 3'],
+        )
+        view = self._view({
+            'step0.widgets.field_0': u'sale',
+            'step0.buttons.continue': u'Continue',
+        })
+        self.assertEqual(view.current_step.prefix, 'step2')
+        self.assertEqual(view.current_index, 1)
+        self.assertEqual(view.active_steps.positions, (0, 2, 3))
+        self.assertEqual(
+            self._labels(view), [u'Step 0', u'Step 2', u'Step 3'],
+        )
+        self.assertFalse(view.on_last_step)
+
+        view = self._view({'step2.buttons.continue': u'Continue'})
+        self.assertEqual(view.current_step.prefix, 'step3')
+        self.assertTrue(view.on_last_step)
+        view = self._view({'step3.buttons.back': u'Back'})
+        self.assertEqual(view.current_step.prefix, 'step2')
+        view = self._view({'step2.buttons.back': u'Back'})
+        self.assertEqual(view.current_step.prefix, 'step0')
+
+        # Changing the offer switches the branch, finished steps keep their
+        # state by position.
+        view = self._view({
+            'step0.widgets.field_0': u'rent',
+            'step0.buttons.continue': u'Continue',
+        })
+        self.assertEqual(view.current_step.prefix, 'step1')
+        self.assertEqual(view.active_steps.positions, (0, 1, 3))
+        self.assertTrue(view.finished_steps & 1 << 2)
+        self.assertFalse(view.finished_steps & 1 << 1)
+
+    def test_memoized(self):
+        self._view()
+        del self.calls[:]
+        view = self._view()
+        self._view()
+        self.assertEqual(self.calls, [])
+        self.assertEqual(view.step_path(), (0, 3))
+
+    def test_not_memoized(self):
+        for step in self.wizard_class.steps:
+            step.depends_on = None
+        self._view()
+        del self.calls[:]
+        self._view()
+        self.assertEqual(self.calls, [u'rent', u'sale'])
+
+    def test_next_step(self):
+        steps = self.wizard_class.steps
+        steps[0].next_step = lambda wizard: 'step2' if _offer(wizard) else None
+        steps[0].depends_on = [('step0', 'field_0')]
+        steps[1].condition = steps[2].condition = None
+        view = self._view()
+        self.assertEqual(view.step_path(), (0, 1, 2, 3))
+        view = self._view({
+            'step0.widgets.field_0': u'sale',
+            'step0.buttons.continue': u'Continue',
+        })
+        self.assertEqual(view.step_path(), (0, 2, 3))
+        self.assertEqual(view.current_step.prefix, 'step2')
+        steps[3].next_step = 'step0'
+        self.assertEqual(compute_step_path(view), (0, 2, 3))
+
+    def test_unknown_next_step(self):
+        self.wizard_class.steps[0].next_step = 'missing'
+        with self.assertRaises(ValueError) as context:
+            self._view()
+        self.assertIn('step0', str(context.exception))
+        self.assertIn('missing', str(context.exception))
+
+    def test_shorter_path(self):
+        self.wizard_class.steps[3].condition = lambda wizard: False
+        self.wizard_class.steps[3].depends_on = ()
+        self._view()
+        view = self._view({'step': 3})
+        self.assertEqual(view.current_step.prefix, 'step0')
+        self.assertTrue(view.on_last_step)
+
+
+class TestConcurrentLoad(testing.WizardTestCase):
+    """Validate loading steps in a thread pool."""
+
+    def setUp(self):
+        super(TestConcurrentLoad, self).setUp()
+        self.threads = set()
+        self.contexts = []
+        threads = self.threads
+        contexts = self.contexts
+        # Set once all concurrent steps are loading at the same time.
+        self.lock = lock = threading.Lock()
+        self.loading = loading = []
+        self.all_loading = all_loading = threading.Event()
+
+        class SlowStep(testing.make_step(0)):
+            concurrent_load = True
+
+            def load(self, context, **kw):
+                threads.add(threading.current_thread().ident)
+                contexts.append(context)
+                if context.get('fail') == self.prefix:
+                    raise ValueError(self.prefix)
+                if self.wizard.load_workers:
+                    with lock:
+                        loading.append(self.prefix)
+                        if len(loading) == 4:
+                            all_loading.set()
+                    all_loading.wait(5)
+                self.getContent()['field_0'] = self.prefix
+
+        steps = []
+        for index in range(4):
+            steps.append(type(
+                'SlowStep{0}'.format(index),
+                (SlowStep, ),
+                {'prefix': 'step{0}'.format(index)},
+            ))
+        self.wizard_class = type('SlowWizard', (Wizard, ), {
+            'steps': tuple(steps),
+            'load_workers': 4,
+        })
+
+    def test_load_concurrently(self):
+        view = self._view()
+        self.assertTrue(self.all_loading.is_set())
+        self.assertNotIn(threading.current_thread().ident, self.threads)
+        for index in range(4):
+            prefix = 'step{0}'.format(index)
+            self.assertEqual(view.session[prefix]['field_0'], prefix)
+
+    def test_load_sequentially(self):
+        self.wizard_class.load_workers = 0
+        view = self._view()
+        self.assertEqual(self.threads, set([threading.current_thread().ident]))
+        self.assertEqual(view.session['step3']['field_0'], 'step3')
+
+    def test_sequential_failure(self):
+        steps = list(self.wizard_class.steps)
+        steps[3] = type('FailingStep', (steps[3], ), {
+            'concurrent_load': False,
+        })
+        self.wizard_class.steps = tuple(steps)
+        self.context['fail'] = 'step3'
+        # Only three steps load concurrently.
+        self.all_loading.set()
+        view = testing.wizard_view(
+            self.wizard_class, self.context, self._request(),
+        )
+        self.assertRaises(ValueError, view.update)
+        # The concurrent steps have been joined and read the session again.
+        for index in range(3):
+            step = view.active_steps[index]
+            self.assertIs(step._load_buffer, None)
+            self.assertEqual(step.getContent()['field_0'], step.prefix)
+
+    def test_separate_connection(self):
+        db = DB(MappingStorage())
+        connection = db.open()
+        connection.root()['context'] = context = testing.make_context()
+        transaction.commit()
+        self.context = context
+        try:
+            self._view()
+            self.assertEqual(len(self.contexts), 4)
+            for loaded in self.contexts:
+                self.assertIsNot(loaded, context)
+                self.assertEqual(loaded._p_oid, context._p_oid)
+                self.assertIsNot(loaded._p_jar, connection)
+        finally:
+            transaction.abort()
+            connection.close()
+            db.close()
+
+
+class TestLazyLoad(testing.WizardTestCase):
+    """Validate loading steps on demand."""
+
+    def setUp(self):
+        super(TestLazyLoad, self).setUp()
+        self.loaded = loaded = []
+
+        class CountingStep(testing.make_step(0)):
+
+            def load(self, context, **kw):
+                loaded.append(self.prefix)
+                if getattr(context, 'finished', False):
+                    self.getContent()['_finished'] = True
+
+        steps = []
+        for index in range(3):
+            steps.append(type(
+                'CountingStep{0}'.format(index),
+                (CountingStep, ),
+                {'prefix': 'step{0}'.format(index)},
+            ))
+        self.wizard_class = type('LazyWizard', (Wizard, ), {
+            'steps': tuple(steps),
+            'lazy_load': True,
+        })
+
+    def test_load_current_step(self):
+        view = self._view()
+        self.assertEqual(self.loaded, ['step0'])
+        self.assertTrue(view.step_loaded(0))
+        self.assertFalse(view.step_loaded(1))
+
+    def test_empty_step_loaded_once(self):
+        self._view()
+        self._view()
+        view = self._view({'step0.buttons.continue': u'Continue'})
+        self.assertEqual(view.current_index, 1)
+        self._view()
+        self.assertEqual(self.loaded, ['step0', 'step1'])
+
+    def test_load_remaining_steps(self):
+        view = self._view()
+        view.apply_steps(self.context)
+        self.assertEqual(self.loaded, ['step0', 'step1', 'step2'])
+        self.assertEqual(view.loaded_steps, 7)
+
+    def test_get_all_data_writes_once(self):
+        self.wizard_class.etag_caching = True
+        view = self._view()
+        etag = view.etag()
+        self.assertEqual(dict(view.get_all_data()), {})
+        self.assertEqual(self.loaded, ['step0', 'step1', 'step2'])
+        self.assertNotEqual(view.etag(), etag)
+
+        # Once all steps are loaded, reading the data writes nothing.
+        etag = view.etag()
+        view = self._view()
+        self.assertEqual(view.etag(), etag)
+        self.assertEqual(dict(view.get_all_data()), {})
+        self.assertEqual(view.etag(), etag)
+        self.assertEqual(view.session.dirty, set())
+        self.assertEqual(self.loaded, ['step0', 'step1', 'step2'])
+
+    def test_eager_load(self):
+        self.wizard_class.lazy_load = False
+        self._view()
+        self._view()
+        self.assertEqual(self.loaded, ['step0', 'step1', 'step2'])
+
+    def test_load_finished(self):
+        self.context.finished = True
+        view = self._view()
+        self.assertEqual(view.finished_steps, 1)
+        view = self._view({'step': 2})
+        self.assertEqual(view.current_index, 2)
+        self.assertEqual(view.finished_steps, 1 | 4)
+        self.assertEqual(self.loaded, ['step0', 'step2'])
+
+    def test_load_steps_override(self):
+        loaded = self.loaded
+
+        def load_steps(self, context):
+            loaded.append('all')
+
+        self.wizard_class.load_steps = load_steps
+        view = self._view()
+        self.assertIn('step0.buttons.continue', view.render())
+        self.assertEqual(self.loaded, ['step0'])
+        view.apply_steps(self.context)
+        self.assertEqual(self.loaded, ['step0', 'all'])
+
+
+class TestApplySteps(unittest.TestCase):
+    """Validate applying all steps to a context."""
+
+    def setUp(self):
+        testing.setUp()
+        self.db = DB(MappingStorage())
+        self.connection = self.db.open()
+        root = self.connection.root()
+        root['context'] = self.context = PersistentMapping()
+        transaction.commit()
+        self.events = events = []
+        provideHandler(events.append, (IObjectModifiedEvent, ))
+
+        class ApplyingStep(testing.make_step(0)):
+
+            def apply(self, context, **kw):
+                context[self.prefix] = True
+                if context.get('fail') == self.prefix:
+                    raise ValueError(self.prefix)
+                if context.get('conflict') == self.prefix:
+                    raise ConflictError()
+                return {IStep0: ['field_0', self.prefix]}
+
+        steps = []
+        for index in range(3):
+            steps.append(type(
+                'ApplyingStep{0}'.format(index),
+                (ApplyingStep, ),
+                {'prefix': 'step{0}'.format(index)},
+            ))
+        IStep0 = steps[0].fields['field_0'].field.interface
+        self.wizard_class = type('ApplyingWizard', (Wizard, ), {
+            'steps': tuple(steps),
+        })
+
+    def tearDown(self):
+        transaction.abort()
+        self.connection.close()
+        self.db.close()
+        testing.tearDown()
+
+    def _view(self):
+        request = testing.make_request()
+        view = testing.wizard_view(
+            self.wizard_class, testing.make_context(), request,
+        )
+        view.update()
+        return view
+
+    def test_single_event(self):
+        changes = self._view().apply_steps(self.context)
+        self.assertEqual(len(self.events), 1)
+        event = self.events[0]
+        self.assertIs(event.object, self.context)
+        self.assertEqual(len(event.descriptions), 1)
+        self.assertEqual(event.descriptions[0].attributes, (
+            'field_0', 'step0', 'step1', 'step2',
+        ))
+        self.assertEqual(list(changes.values()), [
+            ['field_0', 'step0', 'step1', 'step2'],
+        ])
+
+    def test_failing_step(self):
+        self.context['fail'] = 'step1'
+        with self.assertRaises(ApplyError) as context:
+            self._view().apply_steps(self.context)
+        self.assertEqual(list(context.exception.errors), ['step1'])
+        self.assertEqual(self.events, [])
+        # All changes made by apply_steps have been rolled back.
+        self.assertEqual(dict(self.context), {'fail': 'step1'})
+
+    def test_conflict(self):
+        self.context['conflict'] = 'step1'
+        view = self._view()
+        self.assertRaises(ConflictError, view.apply_steps, self.context)
+        self.assertEqual(self.events, [])
+
+
+class TestApplyChanges(unittest.TestCase):
+    """Validate applying form data to step contents."""
+
+    def setUp(self):
+        testing.setUp()
+        step_class = testing.make_step(0, field_count=3)
+        self.step = step_class(testing.make_context(), None, None)
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_apply_changes(self):
+        content = PersistentDict({'field_0': u'old', 'field_1': u'same'})
+        changes = apply_changes(self.step, content, {
+            'field_0': u'new',
+            'field_1': u'same',
+            'unknown': u'ignored',
+        })
+        self.assertEqual(list(changes.values()), [['field_0']])
+        self.assertEqual(
+            dict(content), {'field_0': u'new', 'field_1': u'same'},
+        )
+
+    def test_plan_is_cached(self):
+        content = PersistentDict()
+        plan = get_apply_plan(self.step, content)
+        self.assertIs(get_apply_plan(self.step, content), plan)
+        self.assertEqual([item[0] for item in plan], [
+            'field_0', 'field_1', 'field_2',
+        ])
+
+    def test_plan_follows_registry_changes(self):
+        content = PersistentDict()
+        plan = get_apply_plan(self.step, content)
+
+        class UpperCaseField(DictionaryField):
+
+            def set(self, value):
+                super(UpperCaseField, self).set(value.upper())
+
+        provideAdapter(UpperCaseField, (PersistentDict, IField))
+        self.assertIsNot(get_apply_plan(self.step, content), plan)
+        apply_changes(self.step, content, {'field_0': u'new'})
+        self.assertEqual(content['field_0'], u'NEW')
+
+
+class TestSessionKey(unittest.TestCase):
+    """Validate the session key strategies."""
+
+    def setUp(self):
+        testing.setUp()
+        self.context = testing.make_context()
+        self.wizard_class = testing.make_wizard()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _view(self, strategy):
+        self.wizard_class.session_key_strategy = strategy
+        request = testing.make_request()
+        return testing.wizard_view(self.wizard_class, self.context, request)
+
+    def test_path(self):
+        view = self._view('path')
+        self.assertEqual(view.session_key, ('ps.zope.wizard', ('/', 'wizard')))
+        self.assertIs(view.session_key, view.session_key)
+        self.assertIs(view.storage, view.storage)
+
+    def test_uid(self):
+        self.context.UID = lambda: 'a1b2c3'
+        view = self._view('uid')
+        self.assertEqual(
+            view.session_key, ('ps.zope.wizard', ('a1b2c3', 'wizard')),
+        )
+
+    def test_fallback_to_path(self):
+        for strategy in ('uid', 'intid'):
+            view = self._view(strategy)
+            self.assertEqual(
+                view.session_key, ('ps.zope.wizard', ('/', 'wizard')),
+            )
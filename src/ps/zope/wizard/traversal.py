@@ -20,30 +20,57 @@ from ps.zope.wizard.wizard import Wizard
 class WizardWidgetTraversal(object):
     """Allow traversal to widgets via the ++widget++ namespace."""
 
+    # Set to True to update every active step before traversing, instead of
+    # only the wizard and the step owning the requested widget.
+    update_all_steps = False
+
     def __init__(self, context, request=None):
         self.context = context
         self.request = request
 
     def _prepareForm(self):
+        # Updating the wizard also updates its current step.
         self.context.update()
-        for step in self.context.active_steps:
-            step.update()
+        if self.update_all_steps:
+            for step in self.context.active_steps:
+                if step is not self.context.current_step:
+                    step.update()
         return self.context
 
+    def _prepareStep(self, form, name):
+        """Return the step owning a widget name and the remaining name.
+
+        Only the owning step gets updated. Returns (None, name) if the name
+        does not start with the widgets prefix of a step.
+        """
+        parts = name.split('.')
+        for length in range(len(parts) - 1, 0, -1):
+            if parts[length] != 'widgets':
+                continue
+            index = form.active_steps.index_of_prefix(
+                util.expandPrefix('.'.join(parts[:length])))
+            if index is None:
+                continue
+            step = form.active_steps[index]
+            if step is not form.current_step and not self.update_all_steps:
+                step.update()
+            return step, '.'.join(parts[length + 1:])
+        return None, name
+
     def traverse(self, name, ignored):  # noqa
         form = self._prepareForm()
 
-        # Since we cannot check security during traversal,
-        # we delegate the check to the widget view.
-        # alsoProvides(self.request, IDeferSecurityCheck)
-        form.update()
-        # noLongerProvides(self.request, IDeferSecurityCheck)
-
         # If name begins with form.widgets., remove it
         form_widgets_prefix = util.expandPrefix(
             form.prefix) + util.expandPrefix(form.widgets.prefix)
         if name.startswith(form_widgets_prefix):
             name = name[len(form_widgets_prefix):]
+        else:
+            # If name begins with the widgets prefix of a step, start the
+            # traversal from that step.
+            step, step_name = self._prepareStep(form, name)
+            if step is not None:
+                form, name = step, step_name
 
         # Split string up into dotted segments and work through
         target = form
@@ -58,16 +85,12 @@ class WizardWidgetTraversal(object):
                 except IndexError:
                     raise TraversalError("'" + part + "' not in range")
                 except ValueError:
-                    # HACK: part isn't integer. Iterate through widgets to
-                    # find matching name. This is required for
-                    # DataGridField, which appends 'AA' and 'TT' rows to
-                    # it's widget list.
+                    # Part isn't integer, look the widget up by name. This
+                    # is required for DataGridField, which appends 'AA' and
+                    # 'TT' rows to it's widget list.
                     full_name = util.expandPrefix(target.prefix) + part
-                    filtered = [w for w in target.widgets
-                                if w.name == full_name]
-                    if len(filtered) == 1:
-                        target = filtered[0]
-                    else:
+                    target = self._find_row(target.widgets, full_name)
+                    if target is None:
                         raise TraversalError("'" + part + "' not valid index")
             elif hasattr(target, 'widgets'):  # Either base form, or subform
                 # Check to see if we can find a "Behaviour.widget"
@@ -109,6 +132,20 @@ class WizardWidgetTraversal(object):
             return target
         raise TraversalError(name)
 
+    def _find_row(self, widgets, name):
+        """Return the widget with name from the widgets of a MultiWidget.
+
+        The rows added by DataGridField come last, so the widgets are
+        scanned from the end. Returns None unless exactly one row matches.
+        """
+        found = None
+        for widget in reversed(widgets):
+            if widget.name == name:
+                if found is not None:
+                    return None
+                found = widget
+        return found
+
     def _form_traverse(self, form, name):
         """Look for name within a form."""
         # If we have a current step, look for the widget here first.
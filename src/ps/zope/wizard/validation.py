@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Inline validation of wizard steps.
+
+The ``@@wizard-validate`` view of a wizard validates the input of a single
+step and reports the errors as JSON, e.g. for validating a field when it
+loses the focus::
+
+    POST /context/@@wizard/@@wizard-validate
+    step1.widgets.email=...&prefix=step1
+
+returns ``{"prefix": "step1", "errors": {"step1.widgets.email": "..."}}``.
+Only the fields with input in the request are validated, unless the
+``fields`` parameter lists field names. ``prefix`` defaults to the current
+step. The wizard data is never changed.
+"""
+
+# python imports
+import json
+
+# zope imports
+from z3c.form import util
+from zope.i18n import translate
+from zope.publisher.browser import BrowserView
+
+
+class WizardValidation(BrowserView):
+    """Validate the input of a wizard step."""
+
+    def field_names(self, step):
+        """Return the names of the fields of step with input in the request.
+
+        Widgets may use several request keys, e.g. ``name-empty-marker``
+        or ``name.year``.
+        """
+        form = self.request.form
+        names = form.get('fields', None)
+        if names is not None:
+            if not isinstance(names, (list, tuple)):
+                names = names.split(',')
+            return names
+        result = []
+        # The widgets are not created yet.
+        widget_prefix = util.expandPrefix(step.prefix) + 'widgets.'
+        for name in step.fields:
+            key = widget_prefix + name
+            for request_key in form:
+                if request_key == key or \
+                        request_key.startswith(key + '.') or \
+                        request_key.startswith(key + '-'):
+                    result.append(name)
+                    break
+        return result
+
+    def __call__(self):
+        response = self.request.response
+        response.setHeader('Content-Type', 'application/json')
+        response.setHeader('Cache-Control', 'no-cache')
+        wizard = self.context
+        prefix = self.request.form.get('prefix', None)
+        try:
+            step, errors = wizard.validate(prefix, self.field_names)
+        except LookupError:
+            response.setStatus(404)
+            return json.dumps({'prefix': prefix, 'errors': {}})
+        result = {}
+        for error in errors:
+            widget = getattr(error, 'widget', None)
+            name = widget.name if widget is not None else ''
+            result[name] = translate(error.message, context=self.request)
+        return json.dumps({'prefix': step.prefix, 'errors': result})
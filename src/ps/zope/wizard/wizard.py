@@ -1,29 +1,200 @@
 # -*- coding: utf-8 -*-
 """A z3c.form based wizard with adjustable storage backends."""
 
+# python imports
+import collections
+import json
+import operator
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 # zope imports
-from persistent.dict import PersistentDict
+import transaction
 from z3c.form import (
     button,
     field,
     form,
+    util,
+)
+from z3c.form.datamanager import DictionaryField
+from z3c.form.interfaces import (
+    IDataManager,
+    NO_VALUE,
 )
-from z3c.form.interfaces import IDataManager
 from zope.browserpage import ViewPageTemplateFile
-from zope.component import getMultiAdapter
-from zope.interface import implementer
+from zope.component.hooks import (
+    getSite,
+    setSite,
+)
+from zope.component import (
+    getAdapter,
+    getMultiAdapter,
+    getSiteManager,
+    getUtility,
+    queryUtility,
+)
+from zope.event import notify
+from zope.interface import (
+    implementer,
+    providedBy,
+)
+from zope.lifecycleevent import (
+    Attributes,
+    ObjectModifiedEvent,
+)
 from zope.session.interfaces import ISession
 from zope.traversing.api import getPath
 from zope.traversing.browser import absoluteURL
 
+try:
+    from zope.intid.interfaces import IIntIds
+except ImportError:
+    IIntIds = None
+
+try:
+    from plone.uuid.interfaces import IUUID
+except ImportError:
+    IUUID = None
+
+try:
+    from z3c.pt.pagetemplate import ViewPageTemplateFile as \
+        ChameleonPageTemplateFile
+except ImportError:
+    ChameleonPageTemplateFile = None
+
 # local imports
+from ps.zope.wizard.instrumentation import (
+    measure,
+    record_session_bytes,
+    report,
+    timed,
+)
 from ps.zope.wizard.interfaces import (
     IStep,
     IWizard,
+    IWizardJobQueue,
+    IWizardJobRunner,
+    IWizardStorage,
+)
+from ps.zope.wizard.jobs import (
+    WizardJob,
+    snapshot,
+)
+from ps.zope.wizard.storage import (
+    FINISHED_STEPS_KEY,
+    LOADED_STEPS_KEY,
+    STEP_LAYOUT_KEY,
+    REVISION_KEY,
+    TRANSIENT_ERRORS,
+    WIZARD_SESSION_KEY,
+    MergedData,
+    StepContent,
+    WizardSession,
+)
+
+
+class ApplyError(Exception):
+    """Applying the steps of a wizard failed.
+
+    ``errors`` maps the prefixes of the failing steps to their exceptions.
+    """
+
+    def __init__(self, errors):
+        super(ApplyError, self).__init__(
+            'Failed to apply steps: {0}'.format(', '.join(
+                '{0} ({1!r})'.format(prefix, errors[prefix])
+                for prefix in sorted(errors)
+            )),
+        )
+        self.errors = errors
+
+
+StepInfo = collections.namedtuple(
+    'StepInfo', ['index', 'label', 'prefix', 'finished'],
+)
+NavigationItem = collections.namedtuple(
+    'NavigationItem', ['index', 'label', 'url', 'state'],
 )
 
 
-WIZARD_SESSION_KEY = 'ps.zope.wizard'
+# Apply plans by (form class, provided interfaces of the content).
+_apply_plans = {}
+
+
+def _registry_state(registry):
+    """Return a token which changes whenever the adapter registry changes."""
+    return tuple(
+        (id(base), getattr(base, '_generation', 0))
+        for base in getattr(registry, 'ro', (registry, ))
+    )
+
+
+def _dictionary_setter(field):
+    """Create a setter for dictionary contents, avoiding the datamanager."""
+    def setter(content, value):
+        old_value = content.get(field.__name__, NO_VALUE)
+        if old_value == value:
+            return False
+        if field.readonly:
+            raise TypeError(
+                "Can't set values on read-only fields name={0}".format(
+                    field.__name__,
+                ),
+            )
+        content[field.__name__] = value
+        return True
+    return setter
+
+
+def _datamanager_setter(field, factory):
+    """Create a setter using a datamanager factory."""
+    def setter(content, value):
+        dm = factory(content, field)
+        if dm.query() == value:
+            return False
+        dm.set(value)
+        return True
+    return setter
+
+
+def get_apply_plan(form, content):
+    """Return the prebuilt setters to apply data of a form to a content.
+
+    The datamanager of each field is looked up once per form class and
+    content type. Plans are rebuilt when the component registry changes.
+    """
+    registry = getSiteManager().adapters
+    state = _registry_state(registry)
+    key = (form.__class__, providedBy(content))
+    cached = _apply_plans.get(key, None)
+    if cached is not None and cached[0] == state and \
+            cached[1] is form.fields:
+        return cached[2]
+
+    plan = []
+    for name, _field in form.fields.items():
+        schema_field = _field.field
+        factory = registry.lookup(
+            (providedBy(content), providedBy(schema_field)),
+            IDataManager,
+        )
+        if factory is None:
+            # Fail the same way getMultiAdapter would do.
+            getMultiAdapter((content, schema_field), IDataManager)
+        if factory is DictionaryField:
+            setter = _dictionary_setter(schema_field)
+        else:
+            setter = _datamanager_setter(schema_field, factory)
+        plan.append((name, schema_field.interface, setter))
+    plan = tuple(plan)
+    _apply_plans[key] = (state, form.fields, plan)
+    return plan
 
 
 def apply_changes(form, content, data):
@@ -33,21 +204,313 @@ def apply_changes(form, content, data):
     z3c.form.form, to make it not break if there's no value set yet.
     """
     changes = {}
-    for name, _field in form.fields.items():
+    for name, interface, setter in get_apply_plan(form, content):
         # If the field is not in the data, then go on to the next one.
         if name not in data:
             continue
-        # Get the datamanager and get the original value.
-        dm = getMultiAdapter((content, _field.field), IDataManager)
-        old_value = dm.query()
         # Only update the data, if it is different.
-        if old_value != data[name]:
-            dm.set(data[name])
+        if setter(content, data[name]):
             # Record the change using information required later.
-            changes.setdefault(dm.field.interface, []).append(name)
+            changes.setdefault(interface, []).append(name)
     return changes
 
 
+# Step paths by (wizard class, steps, values of the dependencies).
+_step_paths = {}
+_STEP_PATHS_MAXSIZE = 1000
+
+
+def _step_attribute(factory, name):
+    """Return a function set as class attribute of a step, or the value."""
+    value = getattr(factory, name, None)
+    # Functions defined in a class body are unbound methods on Python 2.
+    return getattr(value, '__func__', value)
+
+
+def _freeze(value):
+    """Return a hashable version of a session value."""
+    if hasattr(value, 'keys'):
+        return tuple(sorted(
+            (key, _freeze(value[key])) for key in value.keys()
+        ))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def compute_step_path(wizard):
+    """Return the positions in ``wizard.steps`` of the active steps.
+
+    Starting with the first step, steps are added unless their condition
+    fails. A step's ``next_step`` (a prefix or a function returning one)
+    continues the path at another step. A ValueError is raised if no step
+    uses that prefix.
+    """
+    steps = tuple(wizard.steps)
+    prefixes = dict(
+        (util.expandPrefix(factory.prefix), position)
+        for position, factory in reversed(list(enumerate(steps)))
+    )
+    path = []
+    position = 0
+    while position < len(steps) and position not in path:
+        factory = steps[position]
+        condition = _step_attribute(factory, 'condition')
+        if condition is not None and not condition(wizard):
+            position += 1
+            continue
+        path.append(position)
+        target = _step_attribute(factory, 'next_step')
+        if callable(target):
+            target = target(wizard)
+        if target is None:
+            position += 1
+            continue
+        try:
+            position = prefixes[util.expandPrefix(target)]
+        except KeyError:
+            raise ValueError(
+                'Unknown next step of step {0}: {1}'.format(
+                    factory.prefix, target,
+                ),
+            )
+    return tuple(path)
+
+
+def get_step_path(wizard):
+    """Return the positions of the active steps, memoized if possible.
+
+    Paths are memoized by the values of the session data declared in the
+    ``depends_on`` attribute of the steps with a condition or branch
+    target. Wizards without such steps use all steps, wizards with steps
+    not declaring their dependencies compute the path every time.
+    """
+    steps = tuple(wizard.steps)
+    dependencies = []
+    for factory in steps:
+        if _step_attribute(factory, 'condition') is None and \
+                _step_attribute(factory, 'next_step') is None:
+            continue
+        depends_on = getattr(factory, 'depends_on', None)
+        if depends_on is None:
+            return compute_step_path(wizard)
+        dependencies.extend(depends_on)
+    if not dependencies:
+        return tuple(range(len(steps)))
+
+    values = []
+    for dependency in dependencies:
+        if isinstance(dependency, tuple):
+            prefix, name = dependency
+            content = wizard.session.get(prefix, None)
+            values.append(content.get(name, None) if content else None)
+        else:
+            values.append(wizard.session.get(dependency, None))
+    key = (wizard.__class__, steps, _freeze(values))
+    path = _step_paths.get(key, None)
+    if path is None:
+        if len(_step_paths) >= _STEP_PATHS_MAXSIZE:
+            _step_paths.clear()
+        path = _step_paths[key] = compute_step_path(wizard)
+    return path
+
+
+class LazySteps(object):
+    """A sequence of wizard steps which are instantiated on first access.
+
+    Only the steps which are actually used in a request (e.g. the current
+    step) are constructed. Light metadata like the label, prefix or the
+    finished state are available without creating the step form.
+
+    positions are the positions of the steps in the ``steps`` of the
+    wizard, which identify them in the finished and loaded bitmaps.
+    """
+
+    def __init__(self, wizard, factories, positions=None):
+        self.wizard = wizard
+        self.factories = tuple(factories)
+        if positions is None:
+            positions = range(len(self.factories))
+        self.positions = tuple(positions)
+        self._steps = {}
+        self._prefixes = dict(
+            (util.expandPrefix(factory.prefix), index)
+            for index, factory in reversed(list(enumerate(self.factories)))
+        )
+        # Steps with a custom finished property can't use the bitmap.
+        self._custom_finished = tuple(
+            index for index, factory in enumerate(self.factories)
+            if getattr(factory, 'finished', None) is not Step.finished
+        )
+
+    def __len__(self):
+        return len(self.factories)
+
+    def __iter__(self):
+        for index in range(len(self.factories)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [
+                self[idx] for idx in range(*index.indices(len(self)))
+            ]
+        index = self._normalize(index)
+        step = self._steps.get(index, None)
+        if step is None:
+            step = self.factories[index](
+                self.wizard.context, self.wizard.request, self.wizard,
+            )
+            self._steps[index] = step
+        return step
+
+    def _normalize(self, index):
+        index = operator.index(index)
+        if index < 0:
+            index += len(self.factories)
+        if not 0 <= index < len(self.factories):
+            raise IndexError('step index out of range')
+        return index
+
+    def bit(self, index):
+        """Return the bit of the step at index in the wizard bitmaps."""
+        return 1 << self.positions[self._normalize(index)]
+
+    def is_instantiated(self, index):
+        """Check if the step at the given index has been constructed."""
+        return self._normalize(index) in self._steps
+
+    def label(self, index):
+        """Return the label of a step without constructing it."""
+        index = self._normalize(index)
+        if index in self._steps:
+            return self._steps[index].label
+        return self.factories[index].label
+
+    def prefix(self, index):
+        """Return the prefix of a step without constructing it."""
+        index = self._normalize(index)
+        if index in self._steps:
+            return self._steps[index].prefix
+        return self.factories[index].prefix
+
+    def index_of_prefix(self, prefix):
+        """Return the index of the first step using the given prefix.
+
+        Returns None if no step uses the prefix.
+        """
+        return self._prefixes.get(util.expandPrefix(prefix), None)
+
+    def finished(self, index):
+        """Return the finished state of a step.
+
+        The state is read from the finished steps bitmap of the wizard,
+        unless the step class provides a custom implementation of the
+        finished property.
+        """
+        index = self._normalize(index)
+        if index in self._custom_finished:
+            return self[index].finished
+        return bool(self.wizard.finished_steps & self.bit(index))
+
+    def all_finished(self):
+        """Check if all steps are finished."""
+        mask = 0
+        for index in range(len(self.factories)):
+            if index not in self._custom_finished:
+                mask |= self.bit(index)
+            elif not self[index].finished:
+                return False
+        return self.wizard.finished_steps & mask == mask
+
+    def info(self, index):
+        """Return the light metadata of a step."""
+        index = self._normalize(index)
+        return StepInfo(
+            index,
+            self.label(index),
+            self.prefix(index),
+            self.finished(index),
+        )
+
+    def infos(self):
+        """Return the light metadata of all steps."""
+        return [self.info(index) for index in range(len(self.factories))]
+
+
+class ConcurrentLoader(object):
+    """Load steps in a bounded pool of threads.
+
+    While loading, each step writes to a private buffer. The buffers are
+    merged into the session by ``join``, which runs in the calling thread,
+    so the session is only changed by a single thread. Persistent objects
+    can't be shared between threads, so each worker loads the context (and
+    the site) from its own connection to the database.
+    """
+
+    def __init__(self, steps, context, workers):
+        self.steps = list(steps)
+        self.context = context
+        self.workers = min(workers, len(self.steps))
+        self.queue = queue.Queue()
+        self.errors = []
+        self.threads = []
+
+    def start(self):
+        site = getSite()
+        for step in self.steps:
+            step._load_buffer = dict(step.getContent())
+            self.queue.put(step)
+        for num in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(site, ))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self, site):
+        context = self.context
+        connection = None
+        jar = getattr(context, '_p_jar', None)
+        if jar is not None:
+            connection = jar.db().open()
+            context = connection.get(context._p_oid)
+            site_jar = getattr(site, '_p_jar', None)
+            if site_jar is not None:
+                site = connection.get_connection(
+                    site_jar.db().database_name,
+                ).get(site._p_oid)
+        setSite(site)
+        try:
+            while True:
+                try:
+                    step = self.queue.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    step.load(context)
+                except Exception as error:
+                    self.errors.append(error)
+        finally:
+            setSite(None)
+            if connection is not None:
+                # Loading must not change anything.
+                transaction.abort()
+                connection.close()
+
+    def join(self, raise_errors=True):
+        """Wait for all steps and merge the loaded data into the session."""
+        for thread in self.threads:
+            thread.join()
+        for step in self.steps:
+            data, step._load_buffer = step._load_buffer, None
+            content = step.getContent()
+            if data and dict(content) != data:
+                content.update(data)
+                step.wizard.session.mark_dirty(step.prefix)
+        if self.errors and raise_errors:
+            raise self.errors[0]
+
+
 @implementer(IStep)
 class Step(form.Form):
     """Base class for a wizard step implementing the IStep interface.
@@ -59,22 +522,43 @@ class Step(form.Form):
     description = u''
     wizard = None
     enabled = True
+    # Set to True if the load method is I/O bound and thread-safe, to allow
+    # loading the step concurrently with other steps. Such load methods must
+    # only use the context they are called with, see IStep.
+    concurrent_load = False
+    # A function condition(wizard) deciding if the step is active, see
+    # IStep. depends_on lists the session data the condition and next_step
+    # depend on: step prefixes or (prefix, field name) tuples.
+    condition = None
+    next_step = None
+    depends_on = None
+
+    _load_buffer = None
 
     def __init__(self, context, request, wizard):
         super(Step, self).__init__(context, request)
         self.wizard = wizard
 
     def getContent(self):
-        """See z3c.form.interfaces.IForm."""
-        return self.wizard.session.setdefault(self.prefix, PersistentDict())
+        """See z3c.form.interfaces.IForm.
+
+        Returns a copy-on-write view if the step has no content yet, so
+        reading doesn't create anything in the session.
+        """
+        if self._load_buffer is not None:
+            return self._load_buffer
+        content = self.wizard.session.get(self.prefix, None)
+        if content is None:
+            content = StepContent(self.wizard.session, self.prefix)
+        return content
 
     def update(self):
         """See z3c.form.interfaces.IForm."""
-        session = self.wizard.session
-        data = session.get(self.prefix, None)
-        if not data:
-            self.load(self.wizard.context)
-            self.wizard.sync()
+        wizard = self.wizard
+        index = wizard.active_steps.index_of_prefix(self.prefix)
+        if index is not None and not wizard.step_loaded(index):
+            wizard._load_steps(wizard.context, [index])
+            wizard.sync()
         super(Step, self).update()
 
     def render(self):
@@ -86,7 +570,9 @@ class Step(form.Form):
 
     @property
     def finished(self):
-        content = self.getContent()
+        content = self.wizard.session.get(self.prefix, None)
+        if not content:
+            return False
         return content.get('_finished', False)
 
     def apply_changes(self, data):
@@ -95,7 +581,8 @@ class Step(form.Form):
         The content is typically a PersistentDict in the wizard's session.
         """
         content = self.getContent()
-        apply_changes(self, content, data)
+        if apply_changes(self, content, data):
+            self.wizard.session.mark_dirty(self.prefix)
         self.wizard.sync()
 
     def load(self, context, **kw):
@@ -103,7 +590,12 @@ class Step(form.Form):
         pass
 
     def apply(self, context, **kw):
-        """Update a context based on the session data for this step."""
+        """Update a context based on the session data for this step.
+
+        May return the changes made, as a mapping of interfaces to lists of
+        attribute names (like ``apply_changes``). The wizard notifies a
+        single ObjectModifiedEvent for the changes of all steps.
+        """
         pass
 
     def mark_finished(self, finished):
@@ -113,7 +605,15 @@ class Step(form.Form):
             except TypeError:
                 finished = False
         content = self.getContent()
-        content['_finished'] = finished
+        if content.get('_finished', False) != finished:
+            content['_finished'] = finished
+            self.wizard.session.mark_dirty(self.prefix)
+        index = self.wizard.active_steps.index_of_prefix(self.prefix)
+        if index is not None:
+            self.wizard.set_step_finished(index, finished)
+        # The error branches of the buttons don't save any data, so the
+        # finished state must be stored here.
+        self.wizard.sync()
 
     @property
     def next_url(self):
@@ -125,6 +625,7 @@ class Step(form.Form):
         name='continue',
         condition=lambda form: form.wizard.show_continue()
     )
+    @timed('handle_continue')
     def handle_continue(self, action):
         """"Continue button."""
         data, errors = self.extractData()
@@ -134,17 +635,13 @@ class Step(form.Form):
         else:
             self.apply_changes(data)
             self.mark_finished(True)
-            self.wizard.update_current_step(self.wizard.current_index + 1)
-
-            # Proceeding can change the conditions for the finish button,
-            # so we need to reconstruct the button actions, since we
-            # do not redirect.
-            self.wizard.updateActions()
+            self.wizard.navigate(self.wizard.step_index(self) + 1)
 
     @button.buttonAndHandler(
         u'Finish',
         name='finish',
         condition=lambda form: form.wizard.show_finish())
+    @timed('handle_finish')
     def handle_finish(self, action):
         data, errors = self.extractData()
         if errors:
@@ -156,10 +653,18 @@ class Step(form.Form):
             self.mark_finished(True)
             self.wizard.finished = True
         self.wizard.current_step.apply_changes(data)
-        if self.wizard.finish():
+        try:
+            with measure(self.wizard, 'finish'):
+                finished = self.wizard.finish()
+        except ApplyError:
+            # Stay on this step, the changes have been rolled back.
+            self.status = self.wizard.apply_errors_message
+            self.mark_finished(False)
+            self.wizard.finished = False
+            return
+        if finished:
             # Clear out the session
-            del self.wizard.request_session[self.wizard.session_key]
-            self.wizard.sync()
+            self.wizard.storage.remove(self.wizard.session_key)
             return
         self.mark_finished(False)
         self.wizard.next_url = None
@@ -170,6 +675,7 @@ class Step(form.Form):
         name='back',
         condition=lambda form: form.wizard.show_back(),
     )
+    @timed('handle_back')
     def handle_back(self, action):
         """Back button."""
         if self.wizard.validate_back:
@@ -183,27 +689,27 @@ class Step(form.Form):
             self.apply_changes(data)
             self.mark_finished(True)
 
-        self.wizard.update_current_step(self.wizard.current_index - 1)
-
-        # Going back can change the conditions for the finish button,
-        # so we need to reconstruct the button actions, since we
-        # do not redirect.
-        self.wizard.updateActions()
+        self.wizard.navigate(self.wizard.step_index(self) - 1)
 
     @button.buttonAndHandler(
         u'Cancel',
         name='cancel',
     )
+    @timed('handle_cancel')
     def handle_cancel(self, action):
         """Clear button."""
         # Clear out the session
-        try:
-            del self.wizard.request_session[self.wizard.session_key]
-        except KeyError:
-            pass
-        else:
-            self.wizard.sync()
-        self.request.response.redirect(absoluteURL(self.context, self.request))
+        self.wizard.storage.remove(self.wizard.session_key)
+        self.wizard.next_url = absoluteURL(self.context, self.request)
+
+
+# The wizard template compiled by Chameleon, if z3c.pt is installed. Use it
+# with ``template = chameleon_template`` in a wizard class.
+chameleon_template = None
+if ChameleonPageTemplateFile is not None:
+    chameleon_template = ChameleonPageTemplateFile(
+        os.path.join(os.path.dirname(__file__), 'wizard.pt'),
+    )
 
 
 @implementer(IWizard)
@@ -224,26 +730,80 @@ class Wizard(form.Form):
     current_index = None
     finished = False
     validate_back = True
+    redirect_navigation = False
+    fragment_header = 'X-Wizard-Fragment'
+    fragment_parameter = 'fragment'
+    etag_caching = False
 
     success_message = u'Information submitted successfully.'
     form_errors_message = u'There were errors.'
+    apply_errors_message = u'The information could not be saved.'
     next_url = None
     confirmation_page_name = None
+    storage_name = u''
+    session_key_strategy = 'path'
+    timing_header = None
+    load_workers = 0
+    lazy_load = False
+    job_runner = None
+    data_conflicts = 'last'
+    session_ttl = None
+    max_instances = None
+
+    _session_key = None
+    _request_session = None
+    _storage = None
+    _absolute_url = None
+    _navigation = None
+
+    def __call__(self):
+        try:
+            return super(Wizard, self).__call__()
+        finally:
+            report(self)
 
+    @timed('update')
     def update(self):
         """See z3c.form.interfaces.IForm."""
         # Initialize session.
         session_key = self.session_key
-        if session_key not in self.request_session:
-            self.request_session[session_key] = {}
-        self.session = self.request_session[session_key]
+        storage = self.storage
+        track = self.session_ttl is not None or \
+            self.max_instances is not None
+        data = storage.get(session_key, None)
+        if data is not None and track and storage.expired(session_key):
+            storage.remove(session_key)
+            data = None
+        if data is None:
+            if track:
+                max_entries = self.max_instances
+                if max_entries is not None:
+                    # Make room for the new wizard.
+                    max_entries = max(max_entries - 1, 0)
+                storage.sweep(max_entries)
+            data = storage.create(session_key)
+        if track:
+            storage.touch(session_key, self.session_ttl)
+        self.session = WizardSession(data)
+
+        if self.etag_caching and self.not_modified():
+            # Nothing else is needed to answer with 304.
+            return
 
         self.update_active_steps()
 
         # If this wizard hasn't been loaded yet in this session, load the data.
-        if not len(self.session):
-            self.initialize()
-            self.sync()
+        new = not len(self.session)
+        self._check_step_layout()
+        if new:
+            if self.etag_caching:
+                # Start with a different revision than former instances of
+                # the wizard, whose pages may still be cached.
+                self.session[REVISION_KEY] = int(time.time() * 1000)
+            with measure(self, 'initialize'):
+                self.initialize()
+            self.session[FINISHED_STEPS_KEY] = self.finished_steps
+        self.sync()
 
         self.jump_to_current_step()
         super(Wizard, self).update()
@@ -259,53 +819,275 @@ class Wizard(form.Form):
             else:
                 self.actions['continue'].disabled = 'disabled'
 
+    @timed('render')
+    def render(self):
+        """See z3c.form.interfaces.IForm."""
+        if self.etag_caching:
+            self.set_cache_headers()
+        if self.fragment_requested():
+            return self.render_fragment()
+        if self.next_url is not None:
+            self.request.response.redirect(self.next_url)
+            return u''
+        return super(Wizard, self).render()
+
+    def etag(self):
+        """Return the entity tag of the page, or None for a new wizard.
+
+        It combines the revision of the wizard data, which is incremented by
+        every sync, with the current step and the rendering mode.
+        """
+        revision = self.session.get(REVISION_KEY, None)
+        if revision is None:
+            return None
+        return '"{0}-{1}{2}"'.format(
+            revision,
+            self.session.get('step', 0),
+            '-fragment' if self.fragment_requested() else '',
+        )
+
+    def not_modified(self):
+        """Answer a conditional GET request with 304 if possible.
+
+        Compares the If-None-Match header to the entity tag of the wizard
+        before any step is updated.
+        """
+        request = self.request
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        header = request.getHeader('If-None-Match', None)
+        etag = self.etag()
+        if not header or etag is None:
+            return False
+        tags = [tag.strip() for tag in header.split(',')]
+        if etag not in tags and '*' not in tags:
+            return False
+        request.response.setStatus(304)
+        self.set_cache_headers()
+        return True
+
+    def set_cache_headers(self):
+        """Let browsers (only) cache the page, revalidating it on every use."""
+        response = self.request.response
+        response.setHeader('Cache-Control', 'private, no-cache')
+        if self.fragment_header:
+            response.setHeader('Vary', self.fragment_header)
+        etag = self.etag()
+        if etag is not None:
+            response.setHeader('ETag', etag)
+
+    def fragment_requested(self):
+        """Check if the request asks for the current step only."""
+        if self.fragment_header and \
+                self.request.getHeader(self.fragment_header):
+            return True
+        return bool(
+            self.fragment_parameter and
+            self.request.form.get(self.fragment_parameter, None)
+        )
+
+    def render_fragment(self):
+        """Render the current step and the state of the wizard as JSON.
+
+        Skips the wizard template and its navigation. Instead of
+        redirecting, the URL to go to is returned as ``next_url``.
+        """
+        response = self.request.response
+        response.setHeader('Content-Type', 'application/json')
+        if not self.etag_caching:
+            response.setHeader('Cache-Control', 'no-cache')
+        steps = self.active_steps
+        state = {
+            'index': self.current_index,
+            'count': len(steps),
+            'prefix': self.current_step.prefix,
+            'label': self.current_step.label,
+            'finished': [steps.finished(index) for index in range(len(steps))],
+            'next_url': self.next_url,
+            'html': u'',
+        }
+        if self.next_url is None:
+            state['html'] = self.current_step.render()
+        return json.dumps(state)
+
     @property
     def session_key(self):
-        """Return the unique session key used by this wizard instance."""
+        """Return the unique session key used by this wizard instance.
+
+        The key is computed once per request.
+        """
+        if self._session_key is None:
+            context_key = self.context_key()
+            path = [] if context_key is None else [context_key]
+            path.append(self.__name__)
+            self._session_key = (WIZARD_SESSION_KEY, tuple(path))
+        return self._session_key
+
+    def context_key(self):
+        """Return the part of the session key identifying the context.
+
+        Depending on ``session_key_strategy`` this is the path, the intid or
+        the UID of the context. Falls back to the path if the context has
+        no intid or UID. Returns None if the context can not be identified.
+        """
+        strategy = self.session_key_strategy
+        if strategy == 'intid' and IIntIds is not None:
+            intids = queryUtility(IIntIds)
+            uid = intids.queryId(self.context) if intids else None
+            if uid is not None:
+                return uid
+        elif strategy == 'uid':
+            uid = IUUID(self.context, None) if IUUID is not None else None
+            if uid is None and callable(getattr(self.context, 'UID', None)):
+                uid = self.context.UID()
+            if uid is not None:
+                return uid
         try:
-            path = [getPath(self.context)]
+            return getPath(self.context)
         except TypeError:
-            path = []
-        path.append(self.__name__)
-        return (WIZARD_SESSION_KEY, tuple(path))
+            return None
 
     @property
     def request_session(self):
-        return ISession(self.request)['ps.zope.wizard']
+        if self._request_session is None:
+            self._request_session = ISession(self.request)[WIZARD_SESSION_KEY]
+        return self._request_session
+
+    @property
+    def storage(self):
+        """The IWizardStorage used to store the wizard data.
 
+        The storage is looked up once per request.
+        """
+        if self._storage is None:
+            self._storage = getAdapter(
+                self, IWizardStorage, name=self.storage_name,
+            )
+        return self._storage
+
+    def step_path(self):
+        """Return the positions in steps of the active steps."""
+        return get_step_path(self)
+
+    @timed('update_active_steps')
     def update_active_steps(self):
-        self.active_steps = []
-        for step in self.steps:
-            step = step(self.context, self.request, self)
-            self.active_steps.append(step)
+        """Compute the path of active steps.
+
+        Keeps the current steps if the path did not change.
+        """
+        positions = self.step_path()
+        steps = getattr(self, 'active_steps', None)
+        if isinstance(steps, LazySteps) and steps.positions == positions:
+            return
+        self.active_steps = LazySteps(
+            self, [self.steps[position] for position in positions], positions,
+        )
+        self._navigation = None
 
     def jump_to_current_step(self):
-        self.update_current_step(self.session.setdefault('step', 0))
+        index = self.session.setdefault('step', 0)
+        # The path may have become shorter.
+        self.update_current_step(min(index, len(self.active_steps) - 1))
         if 'step' in self.request.form:
             self.jump(self.request.form['step'])
 
+    @timed('update_current_step')
     def update_current_step(self, index):
         self.current_index = index
+        self._navigation = None
         self.session['step'] = self.current_index
         self.sync()
         self.current_step = self.active_steps[self.current_index]
         self.current_step.update()
 
+    def step_index(self, step):
+        """Return the index of a step in the path of active steps.
+
+        The path is computed again first, as the data submitted to the
+        step may change it.
+        """
+        self.update_active_steps()
+        index = self.active_steps.index_of_prefix(step.prefix)
+        return self.current_index if index is None else index
+
+    def navigate(self, index):
+        """Move on to the step at index after a successful submit.
+
+        With ``redirect_navigation``, only the session is changed and the
+        browser is redirected to the new step (Post/Redirect/Get), which
+        is updated by the following request.
+        """
+        if self.redirect_navigation:
+            self.current_index = index
+            self._navigation = None
+            self.session['step'] = index
+            self.sync()
+            self.next_url = '{0}?step:int={1}'.format(
+                self.absolute_url, index,
+            )
+            return
+        self.update_current_step(index)
+
+        # Changing the step can change the conditions for the buttons, so
+        # we need to reconstruct the button actions, since we do not
+        # redirect.
+        self.updateActions()
+
     def jump(self, step_idx):
         """Jump to specific step.
 
         A jump is only possible, if the step has been completed already.
         """
+        if step_idx == self.current_index:
+            return
         try:
-            target_step = self.active_steps[step_idx]
-        except (KeyError, TypeError):
+            if not self.step_loaded(step_idx):
+                # A lazily loaded step may be finished by its load method.
+                self._load_steps(self.context, [step_idx])
+                self.sync()
+            finished = self.active_steps.finished(step_idx)
+        except (IndexError, KeyError, TypeError):
             return
-        if not target_step.finished:
+        if not finished:
             return
 
         self.update_current_step(step_idx)
         self.updateActions()
 
+    @timed('validate')
+    def validate(self, prefix=None, names=None):
+        """Validate the input for a step without changing the wizard data.
+
+        Only the widgets of the step with the given prefix (or the current
+        step) are updated, optionally only those of the fields with the
+        given names, or returned by names(step). The wizard, its actions and
+        the other steps are not updated and nothing is written to the
+        session. Returns the step and the error view snippets. Raises
+        LookupError for an unknown prefix.
+        """
+        data = self.storage.get(self.session_key, None)
+        # A new wizard gets a transient session.
+        self.session = WizardSession({} if data is None else data)
+        self.update_active_steps()
+        if prefix is None:
+            index = min(
+                self.session.get('step', 0), len(self.active_steps) - 1,
+            )
+        else:
+            index = self.active_steps.index_of_prefix(prefix)
+            if index is None:
+                raise LookupError(prefix)
+        step = self.active_steps[index]
+        if callable(names):
+            names = names(step)
+        if names is not None:
+            step.fields = step.fields.select(
+                *[name for name in names if name in step.fields]
+            )
+        step.updateWidgets()
+        data, errors = step.extractData()
+        return step, errors
+
     def initialize(self):
         """Called the first time a wizard is viewed in a new wizard session.
 
@@ -315,18 +1097,69 @@ class Wizard(form.Form):
         instead of dict), or else changes to subitems may be changed without
         those changes getting persisted.
 
-        The default implementation calls the 'load_steps' method.
+        The default implementation calls the 'load_steps' method, unless
+        ``lazy_load`` is set. Lazy wizards load each step the first time it
+        becomes current or its data is needed by 'get_all_data' or
+        'apply_steps'.
         """
-        self.load_steps(self.context)
+        if not self.lazy_load:
+            self.load_steps(self.context)
 
     def load_steps(self, context):
         """Load the wizard session data from a context.
 
-        The default implementation calls the 'load' method of each wizard step.
+        The default implementation calls the 'load' method of each wizard step
+        which has not been loaded yet. If ``load_workers`` is set, steps
+        declaring ``concurrent_load`` are loaded in a thread pool while the
+        other steps load sequentially.
         """
-        for step in self.active_steps:
-            if hasattr(step, 'load'):
+        self._load_steps(context)
+
+    @timed('load_steps')
+    def _load_steps(self, context, indexes=None):
+        """Load the steps at the given indexes which haven't been loaded.
+
+        Used by ``load_steps`` and, with ``lazy_load``, to load single
+        steps when they are needed. The finished state set by the load
+        method of a step is recorded in the finished steps bitmap.
+        """
+        if indexes is None:
+            indexes = range(len(self.active_steps))
+        indexes = [index for index in indexes if not self.step_loaded(index)]
+        if not indexes:
+            return
+        steps = [self.active_steps[index] for index in indexes]
+        steps = [step for step in steps if hasattr(step, 'load')]
+        concurrent = []
+        if self.load_workers:
+            concurrent = [
+                step for step in steps
+                if getattr(step, 'concurrent_load', False)
+            ]
+        loader = ConcurrentLoader(concurrent, context, self.load_workers)
+        loader.start()
+        try:
+            for step in steps:
+                if step in concurrent:
+                    continue
+                before = dict(step.getContent())
                 step.load(context)
+                if dict(step.getContent()) != before:
+                    self.session.mark_dirty(step.prefix)
+        except BaseException:
+            # Don't leave the concurrent steps reading their buffers.
+            loader.join(raise_errors=False)
+            raise
+        loader.join()
+        bitmap = self.loaded_steps
+        for index in indexes:
+            bitmap |= self.active_steps.bit(index)
+            content = self.session.get(self.active_steps.prefix(index), None)
+            if content:
+                self.set_step_finished(
+                    index, bool(content.get('_finished', False)),
+                )
+        self.session[LOADED_STEPS_KEY] = bitmap
 
     def finish(self):
         """Called when a wizard is successfully completed
@@ -336,55 +1169,229 @@ class Wizard(form.Form):
         Use this method to carry out some actions based on the values that have
         been filled out during completion of the wizard.
 
-        The default implementation calls the 'apply_steps' method.
+        The default implementation calls the 'apply_steps' method. If
+        ``job_runner`` is set, it queues a job instead and adds the id of
+        the job to the URL of the confirmation page.
         """
+        if self.job_runner is not None:
+            job = self.submit_job()
+            self.next_url = '{0}?job={1}'.format(
+                self.confirmation_page_url(), job.id,
+            )
+            return True
         self.apply_steps(self.context)
         self.next_url = self.confirmation_page_url()
         return True
 
+    def submit_job(self):
+        """Queue a job applying the steps and return it.
+
+        The job holds a snapshot of the wizard data and is executed by the
+        IWizardJobRunner utility named by ``job_runner``.
+        """
+        self.load_steps(self.context)
+        job = WizardJob(
+            self.context,
+            self.__name__,
+            snapshot(self.session),
+            self.confirmation_page_url(),
+        )
+        getUtility(IWizardJobQueue).add(job)
+        getUtility(IWizardJobRunner, name=self.job_runner).schedule(job, self)
+        return job
+
+    def job_status_url(self, job):
+        """Return the URL reporting the status of a job."""
+        return '{0}/@@wizard-job?id={1}'.format(
+            absoluteURL(self.context, self.request), job.id,
+        )
+
     def confirmation_page_url(self):
         return '{0}/{1}'.format(
             absoluteURL(self.context, self.request),
             self.confirmation_page_name or '',
         )
 
+    @timed('apply_steps')
     def apply_steps(self, context):
         """Update a context based on the wizard session data.
 
         The default implementation calls the 'apply' method of each wizard
-        step.
+        step, after loading the steps which haven't been loaded yet. The
+        changes returned by the steps are combined into a single
+        ObjectModifiedEvent, which is returned. If any step fails, the
+        changes of all steps are rolled back and an ApplyError is raised.
+        Conflict errors are raised unchanged, so the request is retried.
         """
+        self.load_steps(self.context)
+        self.sync()
+        changes = {}
+        errors = {}
+        start = transaction.savepoint(optimistic=True)
         for step in self.active_steps:
-            if hasattr(step, 'apply'):
-                step.apply(context)
-
-    def sync(self):
+            if not hasattr(step, 'apply'):
+                continue
+            # Roll back a failing step, so the following steps still see
+            # a consistent context and all failures get reported.
+            savepoint = transaction.savepoint(optimistic=True)
+            try:
+                step_changes = step.apply(context)
+            except TRANSIENT_ERRORS:
+                # Let the publisher retry the request.
+                raise
+            except Exception as error:
+                savepoint.rollback()
+                errors[step.prefix] = error
+                continue
+            for interface, names in (step_changes or {}).items():
+                attributes = changes.setdefault(interface, [])
+                attributes.extend(
+                    name for name in names if name not in attributes
+                )
+        if errors:
+            start.rollback()
+            raise ApplyError(errors)
+        if changes:
+            descriptions = [
+                Attributes(interface, *names)
+                for interface, names in changes.items()
+            ]
+            notify(ObjectModifiedEvent(context, *descriptions))
+        return changes
+
+    @timed('sync')
+    def sync(self, prefix=None):
         """Mark the session as having changed.
 
-        Do this to ensure that changes get persisted.
+        Do this to ensure that changes get persisted. If given, prefix is
+        the prefix of a step which has been changed in place. Only changes
+        recorded in the session are persisted, so nothing is written if no
+        data has changed.
         """
-        self.request_session._p_changed = True
+        if prefix is not None:
+            self.session.mark_dirty(prefix)
+        if not self.session.dirty:
+            return
+        if self.etag_caching:
+            self.session[REVISION_KEY] = self.session.get(REVISION_KEY, 0) + 1
+        session_key = self.session_key
+        storage = self.storage
+        record_session_bytes(
+            self, [self.session.get(key) for key in self.session.dirty],
+        )
+        for key in self.session.dirty:
+            storage.sync(session_key, key)
+        self.session.dirty.clear()
 
     @property
     def absolute_url(self):
-        return '/'.join([
-            absoluteURL(self.context, self.request),
-            self.__name__ or '',
-        ])
+        if self._absolute_url is None:
+            self._absolute_url = '/'.join([
+                absoluteURL(self.context, self.request),
+                self.__name__ or '',
+            ])
+        return self._absolute_url
+
+    @property
+    def navigation(self):
+        """The navigation model, a NavigationItem for each active step.
+
+        The state of an item is 'current', 'finished' (the step can be
+        jumped to) or 'pending'. The model is built once per request and
+        rebuilt if the current step or the finished steps change.
+        """
+        if self._navigation is None:
+            url = self.absolute_url
+            items = []
+            for info in self.active_steps.infos():
+                if info.index == self.current_index:
+                    state = 'current'
+                elif info.finished:
+                    state = 'finished'
+                else:
+                    state = 'pending'
+                items.append(NavigationItem(
+                    info.index,
+                    info.label,
+                    '{0}?step:int={1}'.format(url, info.index),
+                    state,
+                ))
+            self._navigation = tuple(items)
+        return self._navigation
 
     @property
     def on_last_step(self):
-        return self.current_index == len(self.steps) - 1
+        return self.current_index == len(self.active_steps) - 1
 
     def show_continue(self):
         return not self.on_last_step
 
     @property
     def all_steps_finished(self):
-        for step in self.active_steps:
-            if not step.finished:
-                return False
-        return True
+        return self.active_steps.all_finished()
+
+    @property
+    def finished_steps(self):
+        """A bitmap of the finished steps, by position in steps.
+
+        Sessions without a bitmap fall back to the finished flags stored in
+        the step contents.
+        """
+        bitmap = self.session.get(FINISHED_STEPS_KEY, None)
+        if bitmap is not None:
+            return bitmap
+        bitmap = 0
+        for index in range(len(self.active_steps)):
+            data = self.session.get(self.active_steps.prefix(index), None)
+            if data and data.get('_finished', False):
+                bitmap |= self.active_steps.bit(index)
+        return bitmap
+
+    def _check_step_layout(self):
+        """Rebuild the bitmaps if they were built for other steps.
+
+        The bitmaps are keyed by the position of the steps in ``steps``.
+        If steps have been added, removed or reordered since the session
+        was created, the finished steps are read from the finished flags
+        in the step contents again and the loaded steps are forgotten.
+        """
+        layout = tuple(factory.prefix for factory in self.steps)
+        if self.session.get(STEP_LAYOUT_KEY, None) == layout:
+            return
+        bitmap = 0
+        for position, prefix in enumerate(layout):
+            data = self.session.get(prefix, None)
+            if data and data.get('_finished', False):
+                bitmap |= 1 << position
+        self.session[FINISHED_STEPS_KEY] = bitmap
+        if LOADED_STEPS_KEY in self.session:
+            del self.session[LOADED_STEPS_KEY]
+        self.session[STEP_LAYOUT_KEY] = layout
+        self._navigation = None
+
+    @property
+    def loaded_steps(self):
+        """A bitmap of the loaded steps, by position in steps."""
+        return self.session.get(LOADED_STEPS_KEY, 0)
+
+    def step_loaded(self, index):
+        """Check if the data of the step at index has been loaded.
+
+        Steps with data count as loaded, e.g. in sessions without a bitmap.
+        """
+        if self.loaded_steps & self.active_steps.bit(index):
+            return True
+        return bool(self.session.get(self.active_steps.prefix(index), None))
+
+    def set_step_finished(self, index, finished):
+        """Record the finished state of the step at index in the bitmap."""
+        bitmap = self.finished_steps
+        if finished:
+            bitmap |= self.active_steps.bit(index)
+        else:
+            bitmap &= ~self.active_steps.bit(index)
+        self.session[FINISHED_STEPS_KEY] = bitmap
+        self._navigation = None
 
     def show_finish(self):
         return self.all_steps_finished or self.on_last_step
@@ -396,11 +1403,24 @@ class Wizard(form.Form):
     def show_back(self):
         return not self.on_first_step
 
-    def get_all_data(self):
-        result = {}
-        for step in self.active_steps:
-            data = self.session.get(step.prefix, None)
-            result.update(data)
-        if '_finished' in result.keys():
-            del result['_finished']
-        return result
+    def get_all_data(self, conflicts=None):
+        """Return a read-only view of the merged data of all steps.
+
+        Internal keys are hidden. conflicts overrides the ``data_conflicts``
+        policy for keys used by several steps, see ``MergedData``. Use
+        ``dict(wizard.get_all_data())`` to get a copy.
+
+        Steps which haven't been loaded yet are loaded first and synced,
+        as the loaded bitmap must not be stored without their data. This
+        writes to the session and increments the ETag revision. Once all
+        steps are loaded, nothing is written.
+        """
+        self.load_steps(self.context)
+        self.sync()
+        return MergedData(
+            [
+                self.session.get(self.active_steps.prefix(index), None)
+                for index in range(len(self.active_steps))
+            ],
+            conflicts or self.data_conflicts,
+        )